@@ -0,0 +1,9 @@
+def percentile(values, p):
+    """The p-th percentile (0-100) of values, using the nearest rank."""
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+def milliseconds(seconds):
+    return "%8.1f ms" % (seconds * 1000)
@@ -0,0 +1,157 @@
+"""Contention between nodes racing to claim the same jobs, with both claim engines.
+
+Each simulated node is a process with its own backend connection, claiming
+all the jobs (one by default, see --jobs) in a random order. In every window
+all nodes start at the same time, and the window is moved past the range
+before the next one, so that exactly one node must win each job in each
+window. For each engine it reports the claims per second, the time to
+decision (p50/p99), the round trips (reads and writes to the backend) per
+attempt and the consumed capacity (reported only by DynamoDB).
+
+    python -m bench.contention --nodes 32 --windows 20
+    python -m bench.contention --nodes 8 --jobs 100
+    python -m bench.contention --backend dynamodb --region eu-west-1 --table runjop-bench
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import multiprocessing
+
+from bench.common import percentile, milliseconds
+from tests.stand_ins import runjop, options
+
+class CountingBackend(object):
+    """Counts the reads and writes made through a backend."""
+
+    reads = ['last_execution']
+    writes = ['insert_execution', 'update_execution', 'delete_execution', 'claim_lease', 'update_lease']
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.counts = {'reads': 0, 'writes': 0}
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        kind = 'reads' if name in self.reads else 'writes' if name in self.writes else None
+        if kind is None:
+            return attr
+        def call(*args, **kwargs):
+            self.counts[kind] += 1
+            return attr(*args, **kwargs)
+        return call
+
+def node(job_options, pipe):
+    backend = None
+    jobs = []
+    for job_option in job_options:
+        job = runjop.RunJOP(job_option, backend=backend)
+        if backend is None:
+            backend = job.backend = CountingBackend(job.backend)
+        jobs.append(job)
+    pipe.send('ready')
+    while True:
+        request = pipe.recv()
+        if request is None:
+            return
+        now, start_at = request
+        time.sleep(max(0, start_at - time.time()))
+        random.shuffle(jobs)
+        results = []
+        for job in jobs:
+            backend.counts = {'reads': 0, 'writes': 0}
+            job.metrics = job.new_metrics()
+            started = time.time()
+            won = job.claim(now)
+            results.append((job.id, won, time.time() - started, backend.counts['reads'], backend.counts['writes'],
+                            job.metrics.values.get('consumed_capacity', 0)))
+        pipe.send((results, time.time()))
+
+def race(engine, args, db):
+    pipes = []
+    processes = []
+    for i in range(args.nodes):
+        parent, child = multiprocessing.Pipe()
+        job_options = [options('--backend', args.backend, '--db', db, '--region', args.region, '--table', args.table,
+                               '--id', '%s-%s-%i' % (args.id, engine, job), '--node', 'node-%i' % i,
+                               '--range', str(args.range), '--engine', engine)
+                       for job in range(args.jobs)]
+        process = multiprocessing.Process(target=node, args=(job_options, child))
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+    for pipe in pipes:
+        pipe.recv()
+
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    windows = []
+    for window in range(args.windows):
+        # All nodes start together, in a window that is outside of the range of the previous one
+        start_at = time.time() + 0.1
+        when = now + datetime.timedelta(seconds=window * (args.range + 1))
+        for pipe in pipes:
+            pipe.send((when, start_at))
+        responses = [pipe.recv() for pipe in pipes]
+        windows.append(([result for results, _ in responses for result in results],
+                        max(finished for _, finished in responses) - start_at))
+
+    for pipe in pipes:
+        pipe.send(None)
+    for process in processes:
+        process.join()
+    return windows
+
+def report(engine, args, windows):
+    attempts = [result for results, _ in windows for result in results]
+    wrong = []
+    for window, (results, _) in enumerate(windows):
+        winners = {}
+        for result in results:
+            winners[result[0]] = winners.get(result[0], 0) + result[1]
+        wrong += ["window %i job '%s': %i winners" % (window, job_id, count)
+                  for job_id, count in sorted(winners.items()) if count != 1]
+    decisions = [result[2] for result in attempts]
+    print "%-6s %i nodes, %i jobs, %i windows: %s" % (
+        engine, args.nodes, args.jobs, args.windows,
+        ', '.join(wrong) if wrong else "exactly one winner for each job in each window")
+    print "%-6s %8.1f claims/sec  decision p50 %s  p99 %s  reads %.2f  writes %.2f  capacity %.2f per attempt" % (
+        engine, len(attempts) / sum(elapsed for _, elapsed in windows),
+        milliseconds(percentile(decisions, 50)), milliseconds(percentile(decisions, 99)),
+        sum(result[3] for result in attempts) / float(len(attempts)),
+        sum(result[4] for result in attempts) / float(len(attempts)),
+        sum(result[5] for result in attempts) / float(len(attempts)))
+    return not wrong
+
+def main():
+    parser = argparse.ArgumentParser(description="Contention of nodes claiming the same jobs, with both engines.")
+    parser.add_argument("--nodes", metavar="N", type=int, default=16)
+    parser.add_argument("--jobs", metavar="N", type=int, default=1,
+            help="how many job IDs each node claims in every window (default is 1)")
+    parser.add_argument("--windows", metavar="N", type=int, default=10)
+    parser.add_argument("--range", metavar="S", type=int, default=60)
+    parser.add_argument("--engine", choices=['query', 'lease'], action='append',
+            help="the engine to measure (default is both)")
+    parser.add_argument("--backend", choices=['dynamodb', 'sqlite'], default='sqlite')
+    parser.add_argument("--region", default='us-east-1')
+    parser.add_argument("--table", default='runjop_bench')
+    parser.add_argument("--id", default='bench-%i' % os.getpid(),
+            help="the prefix of the job IDs, new ones are used by default")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        ok = True
+        for engine in args.engine or ['query', 'lease']:
+            ok = report(engine, args, race(engine, args, os.path.join(directory, 'runjop.db'))) and ok
+    finally:
+        shutil.rmtree(directory)
+    if not ok:
+        sys.exit("more or less than one winner in a window")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Claim latency and AWS calls per job, one process per job against --manifest.
+
+The same jobs are claimed with DynamoDB and S3 stand-ins where every request
+waits --latency seconds. 'process' starts each job the way cron does: a new
+interpreter (timed separately, as 'startup', by importing runjop in a
+subprocess), then RunJOP.__init__ and the claim. 'manifest' is a Daemon with
+all the jobs in its manifest, whose tick is claimed by its claimer threads.
+'claim' is the time spent on each job, 'since tick' also counts the time a
+job waits for a free claimer (and for a process, the startup).
+
+    python -m bench.manifest --jobs 50 --latency 0.02 --claimers 8
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from bench.common import percentile, milliseconds
+from tests.stand_ins import runjop, options, LocalControlPlane, LocalDynamoDB
+
+def startup_time(runs=5):
+    """Time to start an interpreter and import runjop, which also imports boto."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for i in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, '-c', 'import runjop'], cwd=root)
+        times.append(time.time() - started)
+    return percentile(times, 50)
+
+def timed(claim, times):
+    def timed_claim(now):
+        started = time.time()
+        try:
+            return claim(now)
+        finally:
+            times.append(time.time() - started)
+    return timed_claim
+
+def per_process(args, job_ids, startup):
+    times = []
+    for job_id in job_ids:
+        started = time.time()
+        job = runjop.RunJOP(options('--id', job_id, '--range', '60', '--s3log', 's3://bucket/logs'))
+        if not job.claim(datetime.datetime.utcnow()):
+            raise AssertionError("job '%s' not claimed" % job_id)
+        times.append(startup + time.time() - started)
+    # Each process is started by cron at the tick, they don't wait for each other
+    return times, times
+
+def manifest(args, job_ids, directory, control_plane):
+    filename = os.path.join(directory, 'jobs.json')
+    with open(filename, 'w') as f:
+        json.dump({'jobs': [{'id': job_id, 'schedule': '* * * * *', 'command': 'true'} for job_id in job_ids]}, f)
+    daemon = runjop.Daemon(options('--range', '60', '--s3log', 's3://bucket/logs', '--manifest', filename,
+                                   '--claimers', str(args.claimers)))
+    claims = []
+    for schedule, job in daemon.jobs:
+        job.claim = timed(job.claim, claims)
+    for i in range(daemon.claimers):
+        thread = threading.Thread(target=daemon.claimer)
+        thread.daemon = True
+        thread.start()
+    # The handles are opened once, when the daemon starts
+    control_plane.calls = {}
+    started = time.time()
+    daemon.tick(datetime.datetime.now())
+    since_tick = []
+    for job_id in job_ids:
+        if not daemon.queue.get(timeout=60):
+            raise AssertionError("job not claimed")
+        since_tick.append(time.time() - started)
+    return claims, since_tick
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim latency and AWS calls per job with and without a manifest.")
+    parser.add_argument("--jobs", metavar="N", type=int, default=50)
+    parser.add_argument("--latency", metavar="S", type=float, default=0.02,
+            help="latency of each DynamoDB and S3 request (default is 0.02 seconds)")
+    parser.add_argument("--claimers", metavar="N", type=int, default=8,
+            help="claimer threads of the daemon (default is 8)")
+    args = parser.parse_args()
+
+    job_ids = ['job-%i' % i for i in range(args.jobs)]
+    startup = startup_time()
+    directory = tempfile.mkdtemp()
+    try:
+        for label in ['process', 'manifest']:
+            control_plane = LocalControlPlane(args.latency)
+            dynamodb = LocalDynamoDB(args.latency)
+            with control_plane.installed(), dynamodb.installed():
+                if label == 'process':
+                    claims, since_tick = per_process(args, job_ids, startup)
+                else:
+                    claims, since_tick = manifest(args, job_ids, directory, control_plane)
+            calls = (sum(control_plane.calls.values()) + sum(dynamodb.calls.values())) / float(args.jobs)
+            print "%-8s claim p50 %s  since tick p50 %s  p99 %s  %.1f AWS calls per job" % (
+                label, milliseconds(percentile(claims, 50)), milliseconds(percentile(since_tick, 50)),
+                milliseconds(percentile(since_tick, 99)), calls)
+        print "(process includes %s of interpreter startup and imports per job)" % milliseconds(startup).strip()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
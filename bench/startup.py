@@ -0,0 +1,47 @@
+"""Startup time of a one-shot invocation, with and without the metadata cache.
+
+RunJOP.__init__ is timed against a local stand-in of the DynamoDB and S3
+control plane, where DescribeTable and the bucket validation wait --latency
+seconds each. 'cold' doesn't use the cache, 'warm' uses --cache-ttl with a
+cache filled by a previous invocation.
+
+    python -m bench.startup --runs 20 --latency 0.05
+"""
+
+import time
+import shutil
+import argparse
+import tempfile
+
+from bench.common import percentile, milliseconds
+from tests.stand_ins import runjop, options, LocalControlPlane
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of runjop with and without the metadata cache.")
+    parser.add_argument("--runs", metavar="N", type=int, default=20)
+    parser.add_argument("--latency", metavar="S", type=float, default=0.05,
+            help="latency of each control plane call (default is 0.05 seconds)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for label, cache in [('cold', []), ('warm', ['--cache-ttl', '3600', '--cache-dir', directory])]:
+            job_options = options('--s3log', 's3://bucket/logs', *cache)
+            control_plane = LocalControlPlane(args.latency)
+            with control_plane.installed():
+                if cache:
+                    runjop.RunJOP(job_options)
+                    control_plane.calls = {}
+                times = []
+                for i in range(args.runs):
+                    started = time.time()
+                    runjop.RunJOP(job_options)
+                    times.append(time.time() - started)
+            calls = sum(control_plane.calls.values()) / float(args.runs)
+            print "%-5s p50 %s  p99 %s  %.1f control plane calls per invocation" % (
+                label, milliseconds(percentile(times, 50)), milliseconds(percentile(times, 99)), calls)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Time for another node to take over a job when the node running it dies.
+
+In every trial a node runs a long job from the command line with
+'--backend sqlite --engine lease --heartbeat S' and is killed after its
+range is over. Until then the job must be busy for the other nodes, after
+that another node polls the lease until it takes over.
+
+    python -m bench.takeover --trials 5 --heartbeat 1 --range 1
+"""
+
+import sys
+import shutil
+import argparse
+import tempfile
+
+from bench.common import percentile
+from tests.test_heartbeat import takeover
+
+def main():
+    parser = argparse.ArgumentParser(description="Takeover time of a job when the node running it is killed.")
+    parser.add_argument("--trials", metavar="N", type=int, default=5)
+    parser.add_argument("--heartbeat", metavar="S", type=int, default=1)
+    parser.add_argument("--range", metavar="S", type=int, default=1)
+    args = parser.parse_args()
+
+    times = []
+    for trial in range(args.trials):
+        directory = tempfile.mkdtemp()
+        try:
+            busy, elapsed = takeover(directory, args.heartbeat, args.range)
+        finally:
+            shutil.rmtree(directory)
+        print "trial %i: %s, %s" % (trial, "busy while heartbeats are fresh" if busy else "NOT BUSY while running",
+                                    "taken over after %.2f seconds" % elapsed if elapsed is not None else "NOT TAKEN OVER")
+        if not busy or elapsed is None:
+            sys.exit("the lease didn't protect the running job, or didn't expire")
+        times.append(elapsed)
+    print "takeover with a %i second heartbeat: p50 %.2f  max %.2f seconds" % (
+        args.heartbeat, percentile(times, 50), max(times))
+
+if __name__ == '__main__':
+    main()
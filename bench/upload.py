@@ -0,0 +1,75 @@
+"""Bytes sent to S3 and time added to each job by the upload of its log.
+
+Jobs writing a repetitive log are run with and without --compress and
+--spool, against a local S3 stand-in where every request waits --latency
+seconds. The time added to a job is the time of the invocation minus the
+time of its command. With --spool the logs are then sent by an uploader,
+whose time is reported as background time.
+
+    python -m bench.upload --jobs 10 --lines 100000 --latency 0.2
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from bench.common import milliseconds
+from tests.stand_ins import runjop, options, patched, LocalBucket, LocalKey
+
+def run_jobs(args, directory, label, compress, spooled):
+    bucket = LocalBucket(os.path.join(directory, label), latency=args.latency)
+    spool = os.path.join(directory, label + '-spool')
+    command = "seq 1 %i | sed 's/^/INFO processing record /'" % args.lines
+    mode = list(args.stream)
+    if compress:
+        mode += ['--compress', compress]
+    if spooled:
+        mode += ['--spool', spool]
+    job_options = options('--backend', 'sqlite', '--db', os.path.join(directory, 'runjop.db'), '--id', label,
+                          '--range', '1', '--s3log', 's3://bucket/logs', '--command', command, *mode)
+    added = []
+    for i in range(args.jobs):
+        job = runjop.RunJOP(job_options, s3_buckets={'bucket': bucket})
+        job.spawn_uploader = False
+        started = time.time()
+        job.run()
+        added.append(time.time() - started - job.metrics.phases['command'])
+        time.sleep(1.1) # Outside of the range of the previous execution
+    background = 0
+    if spooled:
+        uploader = runjop.SpoolUploader(spool, runjop.Retrier(60))
+        uploader.get_bucket = lambda bucket_name: bucket
+        started = time.time()
+        uploader.run()
+        background = time.time() - started
+    return bucket.bytes_sent / args.jobs, sum(added) / args.jobs, background / args.jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes sent and time added by the upload of the logs of the jobs.")
+    parser.add_argument("--jobs", metavar="N", type=int, default=5)
+    parser.add_argument("--lines", metavar="N", type=int, default=100000,
+            help="how many lines of output each job writes (default is 100000)")
+    parser.add_argument("--latency", metavar="S", type=float, default=0.2,
+            help="latency of each S3 request (default is 0.2 seconds)")
+    parser.add_argument("--stream", action="store_const", const=['--stream'], default=[],
+            help="stream the output of the jobs")
+    args = parser.parse_args()
+
+    modes = [('plain', None, False), ('gzip', 'gzip', False), ('spool', None, True), ('gzip+spool', 'gzip', True)]
+    if runjop.zstandard:
+        modes += [('zstd', 'zstd', False), ('zstd+spool', 'zstd', True)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        with patched(runjop, 'Key', LocalKey):
+            for label, compress, spooled in modes:
+                sent, added, background = run_jobs(args, directory, label, compress, spooled)
+                print "%-10s %10i bytes sent  %s added  %s in background per job" % (
+                    label, sent, milliseconds(added), milliseconds(background))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,52 @@
 #!/usr/bin/env python
 
+import os
 import subprocess
 import logging
+import logging.handlers
 import datetime
 import urlparse
 import socket
+import httplib
+import copy
+import json
+import time
+import signal
+import threading
+import Queue
+import tempfile
+import calendar
+import sqlite3
+import re
+import random
+import contextlib
+import sys
+import zlib
+import uuid
+import glob
+import fcntl
+
+from cStringIO import StringIO
+
+boto_import_started = time.time()
 
 import boto
 import boto.dynamodb
 import boto.dynamodb.layer2
+import boto.dynamodb.condition
+import boto.dynamodb2
+import boto.dynamodb2.exceptions
+import boto.https_connection
+
+boto_import_time = time.time() - boto_import_started
 
 from boto.s3.key import Key
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 import argparse
 
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +54,10 @@ logger = logging.getLogger('runjop')
 
 class RunJOP(object):
 
-    def __init__(self, options):
+    heartbeat_misses = 3 # How many heartbeats can be missed before the lease expires
+    uploader_log_size = 1024 * 1024 # bytes, before 'uploader.log' in the spool is rotated
+
+    def __init__(self, options, backend=None, s3_buckets=None, retrier=None):
         logger.debug("__init__ '%s'" % options)
 
         # Options Parsing
@@ -70,141 +108,1670 @@ class RunJOP(object):
         else:
             errorAndExit("the command to execute must be provided")
 
+        self.stream = options.stream
+        self.chunk_size = 64 * 1024
+
+        if options.tail > 0:
+            self.tail = int(options.tail)
+        else:
+            errorAndExit("the tail (in bytes) must be greater than 0")
+
+        if options.engine in ('query', 'lease'):
+            self.engine = options.engine
+        else:
+            errorAndExit("the claim engine must be 'query' or 'lease'")
+
+        if options.heartbeat < 0:
+            errorAndExit("the heartbeat interval (in seconds) must not be negative")
+        elif options.heartbeat > 0 and self.engine != 'lease':
+            errorAndExit("the heartbeat requires the lease engine")
+        self.heartbeat = int(options.heartbeat)
+
+        if options.backend in ('dynamodb', 'sqlite'):
+            self.backend_name = options.backend
+        else:
+            errorAndExit("the backend must be 'dynamodb' or 'sqlite'")
+
+        if options.keep >= 0:
+            self.keep = int(options.keep)
+        else:
+            errorAndExit("the number of executions to keep must not be negative")
+
+        if options.max_age >= 0:
+            self.max_age = int(options.max_age)
+        else:
+            errorAndExit("the max age (in seconds) of executions must not be negative")
+
+        if options.cache_ttl > 0:
+            self.cache = MetadataCache(os.path.expanduser(options.cache_dir), options.cache_ttl)
+        elif options.cache_ttl == 0:
+            self.cache = None
+        else:
+            errorAndExit("the cache TTL (in seconds) must not be negative")
+
+        if options.compress in (None, 'gzip', 'zstd'):
+            self.compress = options.compress
+        else:
+            errorAndExit("the compression must be 'gzip' or 'zstd'")
+        if self.compress == 'zstd' and zstandard is None:
+            errorAndExit("the zstandard module is required to compress logs with zstd")
+
+        if options.spool:
+            self.spool = os.path.expanduser(options.spool)
+        else:
+            self.spool = None
+        self.spawn_uploader = True # The daemon has its own uploader
+        self.logfile = options.logfile
+
+        if options.retry_deadline > 0:
+            self.retrier = retrier or Retrier(options.retry_deadline)
+        else:
+            errorAndExit("the retry deadline (in seconds) must be greater than 0")
+
+        self.metrics_sink = get_metrics_sink(options.metrics) if options.metrics else None
+        self.metrics = self.new_metrics()
+        self.metrics.phases['import_boto'] = boto_import_time
+        self.retrier.start(self.metrics)
+
         # AWS Initialization
 
         self.aws_region = options.region # Not used by S3
 
-        if self.s3_bucket_name:
+        if self.s3_bucket_name and s3_buckets and self.s3_bucket_name in s3_buckets:
+            logger.debug("reusing S3 bucket '%s'" % self.s3_bucket_name)
+            self.s3_bucket = s3_buckets[self.s3_bucket_name]
+        elif self.s3_bucket_name and not self.spool:
+            self.metrics.start('init_bucket')
             try:
                 s3 = boto.connect_s3() # Not using AWS region for S3, got an error otherwise, depending on the bucket             
             except boto.exception.NoAuthHandlerFound:
                 errorAndExit("no AWS credentials found")
             if not s3:
                 errorAndExit("no S3 connection")
+            without_retries(s3)
+            if self.cache and self.cache.get('s3', self.s3_bucket_name):
+                logger.debug("S3 bucket '%s' found in cache" % self.s3_bucket_name)
+                self.s3_bucket = s3.get_bucket(self.s3_bucket_name, validate=False)
+            else:
+                try:
+                    self.s3_bucket = self.retrier.call('get_bucket', s3.get_bucket, self.s3_bucket_name)
+                except boto.exception.S3ResponseError as e:
+                    errorAndExit(e.body['message'])
+                if self.cache:
+                    self.cache.put({'name': self.s3_bucket_name}, 's3', self.s3_bucket_name)
+            if s3_buckets is not None:
+                s3_buckets[self.s3_bucket_name] = self.s3_bucket
+            self.metrics.stop('init_bucket')
+
+        if backend is not None:
+            logger.debug("reusing backend '%s'" % backend)
+            self.backend = backend
+        else:
+            with self.metrics.phase('init_backend'):
+                self.backend = get_backend(options, self.retrier, self.cache, self.metrics)
+
+    def new_metrics(self):
+        return Metrics(self.metrics_sink, table=self.table_name, id=self.id, node=self.node,
+                       engine=self.engine, backend=self.backend_name)
+
+    def run(self):
+        logger.debug("run command '%s'" % self.command)
+
+        now = datetime.datetime.utcnow()
+
+        try:
+            if self.claim(now):
+                self.execute(now)
+        except:
+            self.metrics.set('outcome', 'error')
+            raise
+        finally:
+            self.metrics.emit(now)
+
+        if self.metrics.retries:
+            logger.info("retries: %s" % ', '.join("%s=%i" % item for item in sorted(self.metrics.retries.items())))
+
+    def claim(self, now):
+        if self.engine == 'lease':
+            return self.claim_lease(now)
+        else:
+            return self.claim_query(now)
+
+    def claim_lease(self, now):
+        logger.debug("claim lease '%s'" % self.id)
+        logger.debug("now = '%s'" % now.strftime(self.date_format_db))
+
+        now_epoch = calendar.timegm(now.utctimetuple())
+        # With heartbeats the job is busy until they stop, otherwise only the range is used
+        counter = self.backend.claim_lease(self.id, now_epoch, now_epoch - self.range,
+                                           {'time':now.strftime(self.date_format_db),'node':self.node,
+                                            'lease_expires':self.lease_expires(now_epoch)},
+                                           self.metrics)
+        self.counter = counter
+        self.lease_time = now_epoch
+
+        if counter is None:
+
+            self.metrics.set('outcome', 'in_range')
+            logger.info("lease taken by another node in the range of execution")
+            logger.info("command not executed")
+            return False
+
+        if counter == 1:
+            # The lease has just been created, the history can already have executions of the query engine
+            last_item = self.backend.last_execution(self.id, self.metrics)
+            if last_item and last_item['counter'] >= counter:
+                counter = last_item['counter'] + 1
+                logger.info("executions of '%s' continue from %i" % (self.id, counter))
+                if not self.backend.update_lease(self.id, self.node, now_epoch, {'executions': counter}, self.metrics):
+                    self.metrics.set('outcome', 'lost_race')
+                    logger.info("lease taken by another node before update")
+                    logger.info("command not executed")
+                    return False
+                self.counter = counter
+
+        # Append the execution to the history, the lease already guarantees this is the only node running it
+        if not self.backend.insert_execution(self.id, counter, self.execution_attrs(now), self.metrics):
+            logger.warning("execution %i of '%s' not written in the history" % (counter, self.id))
+
+        self.apply_retention(counter)
+
+        return True
+
+    def claim_query(self, now):
+        logger.debug("claim '%s'" % self.id)
+        logger.debug("now = '%s'" % now.strftime(self.date_format_db))
+
+        last_item = self.backend.last_execution(self.id, self.metrics)
+
+        outside_of_range = False
+        counter = 0
+
+        if last_item:
+            logger.debug("last_item = '%s'" % last_item)
+            last_time_str = last_item['time']
+            counter = last_item['counter']
+            logger.debug("last_time_str = '%s'" % last_time_str)
+            logger.debug("counter = '%s'" % counter)
+            last_time = datetime.datetime.strptime(last_time_str, self.date_format_db)
+            delta = datetime.timedelta(seconds=self.range)
+            if abs(now - last_time) > delta:
+                outside_of_range = True
+        else:
+            outside_of_range = True
+
+        logger.debug("outside of range of %i seconds: %s" % (self.range, outside_of_range))
+
+        if not outside_of_range:
+
+            self.metrics.set('outcome', 'in_range')
+            logger.info("not outside of range of execution")
+            logger.info("command not executed")
+            return False
+
+        counter += 1
+        self.counter = counter
+
+        execute_job = self.backend.insert_execution(self.id, counter, self.execution_attrs(now), self.metrics)
+
+        logger.debug("execute_job '%s'" % execute_job)
+
+        if not execute_job:
+
+            self.metrics.set('outcome', 'lost_race')
+            logger.info("taken by another node before update")
+            logger.info("command not executed")
+            return False
+
+        self.apply_retention(counter)
+
+        return True
+
+    def execution_attrs(self, now):
+        attrs = {'time':now.strftime(self.date_format_db),'node':self.node}
+        if self.max_age:
+            # Can be used as the TTL attribute of the DynamoDB table
+            attrs['expires'] = calendar.timegm(now.utctimetuple()) + self.max_age
+        return attrs
+
+    def apply_retention(self, counter):
+        # Executions are numbered without gaps, so deleting one for each new
+        # execution keeps the history bounded without reading it
+        if self.keep and counter > self.keep:
+            self.backend.delete_execution(self.id, counter - self.keep, self.metrics)
+
+    def complete(self, now, returncode):
+        # The command can run for longer than the deadline, the calls made after it get a deadline of their own
+        self.retrier.start(self.metrics)
+        finish = datetime.datetime.utcnow()
+        attrs = self.execution_attrs(now)
+        attrs['finish'] = finish.strftime(self.date_format_db)
+        attrs['duration'] = round((finish - now).total_seconds(), 3)
+        attrs['returncode'] = returncode
+        if not self.backend.update_execution(self.id, self.counter, attrs, self.metrics):
+            logger.warning("completion of execution %i of '%s' not written in the history" % (self.counter, self.id))
+        if self.heartbeat:
+            self.heartbeat_thread.stop()
+            # Releasing the lease, other nodes can run the job as soon as they are outside of the range
             try:
-                self.s3_bucket = s3.get_bucket(self.s3_bucket_name)
-            except boto.exception.S3ResponseError as e:
-                errorAndExit(e.body['message'])
+                released = self.backend.update_lease(self.id, self.node, self.lease_time,
+                                                     {'lease_expires': 0, 'finish': attrs['finish'], 'returncode': returncode},
+                                                     self.metrics)
+            except boto.exception.BotoServerError as e:
+                logger.warning("lease of '%s' not released, it will expire: %s" % (self.id, e))
+            else:
+                if released:
+                    logger.debug("lease of '%s' released" % self.id)
+                else:
+                    logger.warning("lease of '%s' not released, taken by another node" % self.id)
 
-        dynamodb = boto.dynamodb.connect_to_region(self.aws_region)
+    def lease_expires(self, now_epoch):
+        # A few heartbeats can be late before the lease expires
+        return now_epoch + self.heartbeat * self.heartbeat_misses if self.heartbeat else now_epoch
 
-        self.table = None
+    def renew_lease(self):
+        self.retrier.start(self.metrics)
+        try:
+            renewed = self.backend.update_lease(self.id, self.node, self.lease_time,
+                                                {'lease_expires': self.lease_expires(int(time.time()))})
+        except Exception:
+            logger.exception("lease of '%s' not renewed" % self.id)
+            return
+        if renewed:
+            self.metrics.add('heartbeats', 1)
+            logger.debug("lease of '%s' renewed" % self.id)
+        else:
+            self.metrics.add('leases_lost', 1)
+            logger.warning("lease of '%s' taken by another node while running" % self.id)
 
-        while self.table == None:
+    def execute(self, now):
+        if self.heartbeat:
+            self.heartbeat_thread = Heartbeat(self)
+            self.heartbeat_thread.start()
+        try:
+            self.execute_command(now)
+        except boto.exception.S3ResponseError as e:
+            if self.cache and e.error_code == 'NoSuchBucket':
+                logger.info("S3 bucket '%s' not found, invalidating cache" % self.s3_bucket_name)
+                self.cache.invalidate('s3', self.s3_bucket_name)
+            raise
+        finally:
+            if self.heartbeat:
+                self.heartbeat_thread.stop()
+
+    def execute_command(self, now):
+        logger.info("executing command '%s'" % self.command)
+
+        self.metrics.set('outcome', 'executed')
+
+        if self.stream:
+            self.execute_streaming(now)
+            return
+
+        with self.metrics.phase('command'):
+            try:
+                output = subprocess.check_output(self.command, stderr=subprocess.STDOUT, shell=True)
+                returncode = 0
+            except subprocess.CalledProcessError as e:
+                output = e.output
+                returncode = e.returncode
+
+        self.metrics.set('returncode', returncode)
+        self.complete(now, returncode)
+
+        logger.info("returncode = %i" % returncode)
+        logger.info("output:\n%s" % output)
+
+        if self.s3_bucket_name:
+
+            key_name = self.s3_key_name(now, returncode)
+
+            content = '\n'.join(["command:", self.command, "output:", output])
+            with self.metrics.phase('upload'):
+                writer = self.log_writer(key_name)
+                writer.write(content)
+                writer.close(key_name)
+            self.log_written(key_name, writer)
+
+    def execute_streaming(self, now):
+        logger.debug("execute_streaming '%s'" % self.command)
+
+        # The returncode is part of the S3 key name but is known only at the end,
+        # so the output is streamed to a temporary key and renamed afterwards
+        if self.s3_bucket_name:
+            stream = self.log_writer(self.s3_key_name(now) + '.partial')
+            stream.write('\n'.join(["command:", self.command, "output:", '']))
+        else:
+            stream = None
+
+        self.metrics.start('command')
+        tail = ''
+        process = subprocess.Popen(self.command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, shell=True)
+        try:
+            while True:
+                chunk = os.read(process.stdout.fileno(), self.chunk_size)
+                if not chunk:
+                    break
+                if stream:
+                    # A part can be uploaded by each write, while the command is running
+                    self.retrier.start(self.metrics)
+                    stream.write(chunk)
+                tail = (tail + chunk)[-self.tail:]
+            returncode = process.wait()
+        except:
+            process.kill()
+            process.wait()
+            if stream:
+                stream.abort()
+            raise
+
+        self.metrics.stop('command')
+        self.metrics.set('returncode', returncode)
+        self.complete(now, returncode)
+
+        logger.info("returncode = %i" % returncode)
+        logger.info("output (last %i bytes):\n%s" % (self.tail, tail))
+
+        if stream:
+            key_name = self.s3_key_name(now, returncode)
+            with self.metrics.phase('upload'):
+                stream.close(key_name)
+            self.log_written(key_name, stream)
+
+        return returncode
+
+    def log_writer(self, key_name):
+        """Returns a writer for the log of the job, sending it to S3 or to the spool directory."""
+        headers = {'Content-Type': 'text/plain'}
+        if self.compress:
+            headers['Content-Encoding'] = self.compress
+        if self.spool:
+            writer = SpoolWriter(self.spool, self.s3_bucket_name, headers)
+        else:
+            writer = S3StreamWriter(self.s3_bucket, key_name, self.retrier, headers)
+        if self.compress:
+            writer = CompressedWriter(writer, self.compress)
+        return writer
+
+    def log_written(self, key_name, writer):
+        if self.spool:
+            self.metrics.add('bytes_spooled', writer.size)
+            logger.info("output for s3://%s/%s spooled in '%s' (%i bytes)" % (self.s3_bucket_name, key_name, self.spool, writer.size))
+            if self.spawn_uploader:
+                self.start_uploader()
+        else:
+            self.metrics.add('bytes_uploaded', writer.size)
+            logger.info("output written on s3://%s/%s (%i bytes)" % (self.s3_bucket_name, key_name, writer.size))
+
+    def start_uploader(self):
+        # The uploader runs in the background, so that this process doesn't wait for S3;
+        # if another uploader is already working on the spool, the new one exits immediately
+        script = os.path.abspath(__file__) # The package, or runjop.py when used as a script
+        if not os.path.isfile(script):
+            script = os.path.abspath(sys.argv[0]) # e.g. installed in a zipped egg
+        command = [sys.executable, script, 'upload', '--spool', self.spool,
+                   '--retry-deadline', str(self.retrier.deadline)]
+        if self.logfile:
+            command += ['--log', self.logfile]
+        logger.debug("starting uploader '%s'" % command)
+        # The uploaders write their log in the spool, with any error. It is appended to and rotated,
+        # not truncated, because the uploader holding the lock can still be writing in it
+        log_path = os.path.join(self.spool, 'uploader.log')
+        try:
+            if os.path.getsize(log_path) > self.uploader_log_size:
+                os.rename(log_path, log_path + '.1')
+        except OSError:
+            pass
+        try:
+            with open(os.devnull, 'r+') as devnull, open(log_path, 'a') as log:
+                return subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=log,
+                                        close_fds=True, preexec_fn=os.setsid)
+        except (IOError, OSError) as e:
+            logger.warning("cannot start the uploader, the output stays in '%s': %s" % (self.spool, e))
+
+    def s3_key_name(self, now, returncode=None):
+        parts = [self.table_name, self.id, now.strftime(self.date_format_s3), self.node]
+        if returncode is not None:
+            parts.append(str(returncode))
+        return self.s3_prefix + '-'.join(parts) + ('.log' if returncode is not None else '')
+
+class DynamoDBBackend(object):
+    """Coordination backend storing the executions of the jobs in a DynamoDB table.
+
+    The table has 'job_id' as hash key and 'counter' as range key, and is
+    created if it doesn't exist.
+    """
+
+    def __init__(self, table_name, region, retrier, cache=None, metrics=None):
+        self.table_name = table_name
+        self.region = region
+        self.retrier = retrier
+        self.cache = cache
+        self.table = self.get_table(metrics or Metrics())
+        self.dynamodb2 = None
+
+    def __repr__(self):
+        return "DynamoDBBackend(%s, %s)" % (self.region, self.table_name)
+
+    def get_table(self, metrics):
+        dynamodb = boto.dynamodb.connect_to_region(self.region)
+        without_retries(dynamodb.layer1)
+
+        if self.cache:
+            schema = self.cache.get('dynamodb', self.region, self.table_name)
+            if schema:
+                logger.debug("table '%s' found in cache" % self.table_name)
+                return dynamodb.table_from_schema(self.table_name, boto.dynamodb.schema.Schema(schema))
+
+        table = None
+        attempt = 0
+
+        while table == None:
             try:
-                self.table = dynamodb.get_table(self.table_name)
+                with metrics.phase('describe_table'):
+                    table = self.retrier.call('get_table', dynamodb.get_table, self.table_name)
                 logger.debug("table '%s' found" % self.table_name)
-            except boto.exception.DynamoDBResponseError:
+            except boto.exception.DynamoDBResponseError as e:
+                if is_throttling(e):
+                    raise
                 logger.debug("table '%s' not found" % self.table_name)
                 schema = boto.dynamodb.schema.Schema.create(hash_key=('job_id', 'S'), range_key=('counter', 'N'))
                 try:
                     # 1 read/sec + 1 write/sec should be enough
-                    self.table = dynamodb.create_table(self.table_name, schema, read_units=1, write_units=1)
+                    with metrics.phase('create_table'):
+                        table = self.retrier.call('create_table', dynamodb.create_table,
+                                                  self.table_name, schema, read_units=1, write_units=1)
                     logger.info("table '%s' created" % self.table_name)
                 except boto.exception.DynamoDBResponseError as e:
                     logger.debug("boto.exception.DynamoDBResponseError: %s" % e.body['message'])
-                    if u'The rate of control plane requests made by this account is too high' in e.body['message']:
-                        pass
-                    elif u'Table is being created' in e.body['message']:
-                        pass
+                    if u'Table is being created' in e.body['message']:
+                        # Another node is creating it, wait before looking for it again
+                        self.retrier.backoff('create_table', attempt, e)
+                        attempt += 1
                     else:
                         raise
 
         logger.debug("waiting for table '%s' to be active" % self.table_name)
-        self.table.refresh(wait_for_active=True, retry_seconds=5)
+        with metrics.phase('wait_for_active'):
+            self.retrier.call('refresh_table', table.refresh, wait_for_active=True, retry_seconds=5)
         logger.debug("table '%s' is active" % self.table_name)
 
-    def run(self):
-        logger.debug("run command '%s'" % self.command)
+        if self.cache:
+            self.cache.put(table.schema.dict, 'dynamodb', self.region, self.table_name)
 
-        now = datetime.datetime.utcnow()
-        logger.debug("now = '%s'" % now.strftime(self.date_format_db))
+        return table
 
-        result = self.table.query(hash_key=self.id, max_results=1,
-                                  consistent_read=True, scan_index_forward=False)
+    def call(self, operation, metrics, *args):
+        try:
+            return operation(metrics, *args)
+        except boto.exception.JSONResponseError as e:
+            if not self.cache or e.error_code != 'ResourceNotFoundException':
+                raise
+            # The cached table metadata is stale, use the slow path
+            logger.info("table '%s' not found, invalidating cache" % self.table_name)
+            self.cache.invalidate('dynamodb', self.region, self.table_name)
+            self.table = self.get_table(metrics)
+            return operation(metrics, *args)
 
-        outside_of_range = False
-        counter = 0
+    def last_execution(self, job_id, metrics=None):
+        return self.call(self._last_execution, metrics or Metrics(), job_id)
 
+    def _last_execution(self, metrics, job_id):
+        def query():
+            # The request is sent when the result is used
+            result = self.table.query(hash_key=job_id, max_results=1,
+                                      consistent_read=True, scan_index_forward=False)
+            count = result.count
+            metrics.add('consumed_capacity', result.consumed_units)
+            if count > 0:
+                return result.response['Items'][0]
+            return None
         try:
-            if result.count > 0:
-                last_item = result.response['Items'][0]
-                logger.debug("last_item = '%s'" % last_item)
-                last_time_str = last_item['time']
-                counter = last_item['counter']
-                logger.debug("last_time_str = '%s'" % last_time_str)
-                logger.debug("counter = '%s'" % counter)
-                last_time = datetime.datetime.strptime(last_time_str, self.date_format_db)
-                delta = datetime.timedelta(seconds=self.range)
-                if abs(now - last_time) > delta:
-                    outside_of_range = True
-            else:
-                outside_of_range = True
+            with metrics.phase('query'):
+                return self.retrier.call('query', query)
         except boto.exception.DynamoDBResponseError as e:
             logger.debug("DynamoDBResponseError: %s" % e.body['message'])
-            outside_of_range = True
+            if is_throttling(e) or self.cache and e.error_code == 'ResourceNotFoundException':
+                raise
+        return None
 
-        logger.debug("outside of range of %i seconds: %s" % (self.range, outside_of_range))
+    def insert_execution(self, job_id, counter, attrs, metrics=None):
+        return self.call(self._insert_execution, metrics or Metrics(), job_id, counter, attrs)
 
-        if not outside_of_range:
+    def _insert_execution(self, metrics, job_id, counter, attrs):
+        new_item = self.table.new_item(hash_key=job_id, range_key=counter, attrs=attrs)
+        attempts = [0]
+        def put():
+            attempts[0] += 1
+            return new_item.put(expected_value={'job_id':False})
+        try:
+            with metrics.phase('put'):
+                result = self.retrier.call('put', put)
+        except boto.dynamodb.exceptions.DynamoDBConditionalCheckFailedError as e:
+            logger.debug("DynamoDBConditionalCheckFailedError: %s" % e.body['message'])
+            if attempts[0] > 1:
+                # A retried attempt can fail because of an earlier one that succeeded
+                item = self.get_item(job_id, counter, metrics)
+                if item and item.get('node') == attrs['node'] and item.get('time') == attrs['time']:
+                    logger.info("execution %i of '%s' written by a previous attempt" % (counter, job_id))
+                    return True
+            return False
+        except boto.exception.DynamoDBResponseError as e:
+            logger.debug("DynamoDBResponseError: %s" % e.body['message'])
+            if is_throttling(e) or self.cache and e.error_code == 'ResourceNotFoundException':
+                raise
+            return False
+        logger.debug("put result '%s'" % result)
+        metrics.add('consumed_capacity', result.get('ConsumedCapacityUnits', 0))
+        return True
 
-            logger.info("not outside of range of execution")
-            logger.info("command not executed")
-            return
+    def get_item(self, job_id, counter, metrics):
+        try:
+            with metrics.phase('get'):
+                return self.retrier.call('get', self.table.get_item, hash_key=job_id, range_key=counter,
+                                         consistent_read=True)
+        except boto.dynamodb.exceptions.DynamoDBKeyNotFoundError:
+            return None
 
-        counter += 1
-        execute_job = False
+    def update_execution(self, job_id, counter, attrs, metrics=None):
+        return self.call(self._update_execution, metrics or Metrics(), job_id, counter, attrs)
 
-        new_item = self.table.new_item(hash_key=self.id, range_key=counter,
-                                       attrs={'time':now.strftime(self.date_format_db),'node':self.node})
+    def _update_execution(self, metrics, job_id, counter, attrs):
+        item = self.table.new_item(hash_key=job_id, range_key=counter, attrs=attrs)
         try:
-            result = new_item.put(expected_value={'job_id':False})
-            execute_job = True
+            # Only the execution written by the node is updated
+            with metrics.phase('update'):
+                result = self.retrier.call('update', item.put,
+                                           expected_value={'node':attrs['node'],'time':attrs['time']})
         except boto.dynamodb.exceptions.DynamoDBConditionalCheckFailedError as e:
             logger.debug("DynamoDBConditionalCheckFailedError: %s" % e.body['message'])
-            pass
+            return False
         except boto.exception.DynamoDBResponseError as e:
             logger.debug("DynamoDBResponseError: %s" % e.body['message'])
+            if self.cache and e.error_code == 'ResourceNotFoundException':
+                raise
+            return False
+        metrics.add('consumed_capacity', result.get('ConsumedCapacityUnits', 0))
+        return True
+
+    def delete_execution(self, job_id, counter, metrics=None):
+        return self.call(self._delete_execution, metrics or Metrics(), job_id, counter)
+
+    def _delete_execution(self, metrics, job_id, counter):
+        item = self.table.new_item(hash_key=job_id, range_key=counter)
+        try:
+            with metrics.phase('delete'):
+                result = self.retrier.call('delete', item.delete)
+        except boto.exception.DynamoDBResponseError as e:
+            logger.debug("DynamoDBResponseError: %s" % e.body['message'])
+            if self.cache and e.error_code == 'ResourceNotFoundException':
+                raise
+            return False
+        metrics.add('consumed_capacity', result.get('ConsumedCapacityUnits', 0))
+        return True
+
+    def executions(self, job_id, metrics=None, page_size=100):
+        """Yields the executions of a job, newest first, reading them a page at a time."""
+        metrics = metrics or Metrics()
+        start_key = None
+        while True:
+            def query():
+                # The lease item (counter 0) is not an execution
+                result = self.table.query(hash_key=job_id, range_key_condition=boto.dynamodb.condition.GT(0),
+                                          request_limit=page_size, scan_index_forward=False,
+                                          exclusive_start_key=start_key)
+                return result.response
+            with metrics.phase('query'):
+                response = self.call(lambda metrics: self.retrier.call('query', query), metrics)
+            metrics.add('consumed_capacity', response.get('ConsumedCapacityUnits', 0))
+            items = response.get('Items', [])
+            for item in items:
+                yield item
+            if 'LastEvaluatedKey' not in response or not items:
+                return
+            start_key = (job_id, items[-1]['counter'])
+
+    def claim_lease(self, job_id, now, cutoff, attrs, metrics=None):
+        return self.call(self._claim_lease, metrics or Metrics(), job_id, now, cutoff, attrs)
+
+    def _claim_lease(self, metrics, job_id, now, cutoff, attrs):
+        # The lease of a job is the item with counter 0, executions are counted from 1.
+        # The lease is taken with a single conditional update that succeeds only
+        # if the previous lease is older than the cutoff.
+        if self.dynamodb2 is None:
+            # Condition expressions are not supported by the API used by layer2
+            self.dynamodb2 = without_retries(boto.dynamodb2.connect_to_region(self.region))
+        names = {}
+        values = {':now': {'N': str(now)}, ':cutoff': {'N': str(cutoff)}, ':one': {'N': '1'}}
+        updates = ["lease_time = :now"]
+        for name, value in attrs.items():
+            names['#' + name] = name
+            values[':' + name] = dynamodb2_value(value)
+            updates.append("#%s = :%s" % (name, name))
+        attempts = [0]
+        def update_item():
+            attempts[0] += 1
+            return self.dynamodb2.update_item(self.table_name,
+                key={'job_id': {'S': job_id}, 'counter': {'N': '0'}},
+                update_expression="SET %s ADD executions :one" % ', '.join(updates),
+                condition_expression="attribute_not_exists(lease_time) OR (lease_time < :cutoff AND "
+                                     "(attribute_not_exists(lease_expires) OR lease_expires < :now))",
+                expression_attribute_names=names, expression_attribute_values=values,
+                return_values='UPDATED_NEW', return_consumed_capacity='TOTAL')
+        try:
+            with metrics.phase('update_lease'):
+                result = self.retrier.call('update_lease', update_item)
+        except boto.dynamodb2.exceptions.ConditionalCheckFailedException as e:
+            logger.debug("ConditionalCheckFailedException: %s" % e.body['message'])
+            if attempts[0] > 1:
+                # A retried attempt can fail because of an earlier one that succeeded
+                lease = self.get_item(job_id, 0, metrics)
+                if lease and lease.get('lease_time') == now and lease.get('node') == attrs['node']:
+                    logger.info("lease of '%s' taken by a previous attempt" % job_id)
+                    return int(lease['executions'])
+            return None
+        except boto.exception.JSONResponseError as e:
+            logger.debug("JSONResponseError: %s" % e.body['message'])
+            if is_throttling(e) or self.cache and e.error_code == 'ResourceNotFoundException':
+                raise
+            return None
+        logger.debug("update result '%s'" % result)
+        metrics.add('consumed_capacity', result.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        return int(result['Attributes']['executions']['N'])
+
+    def update_lease(self, job_id, node, lease_time, attrs, metrics=None):
+        return self.call(self._update_lease, metrics or Metrics(), job_id, node, lease_time, attrs)
+
+    def _update_lease(self, metrics, job_id, node, lease_time, attrs):
+        # The lease is updated only if it is still owned by the node
+        if self.dynamodb2 is None:
+            self.dynamodb2 = without_retries(boto.dynamodb2.connect_to_region(self.region))
+        names = {'#owner': 'node'}
+        values = {':owner': {'S': node}, ':lease_time': {'N': str(lease_time)}}
+        updates = []
+        for name, value in attrs.items():
+            names['#' + name] = name
+            values[':' + name] = dynamodb2_value(value)
+            updates.append("#%s = :%s" % (name, name))
+        try:
+            with metrics.phase('update_lease'):
+                result = self.retrier.call('update_lease', self.dynamodb2.update_item, self.table_name,
+                    key={'job_id': {'S': job_id}, 'counter': {'N': '0'}},
+                    update_expression="SET %s" % ', '.join(updates),
+                    condition_expression="lease_time = :lease_time AND #owner = :owner",
+                    expression_attribute_names=names, expression_attribute_values=values,
+                    return_consumed_capacity='TOTAL')
+        except boto.dynamodb2.exceptions.ConditionalCheckFailedException as e:
+            logger.debug("ConditionalCheckFailedException: %s" % e.body['message'])
+            return False
+        metrics.add('consumed_capacity', result.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        return True
+
+class SQLiteBackend(object):
+    """Coordination backend storing the executions of the jobs in a local SQLite database.
+
+    It has the same conditional write semantics as DynamoDBBackend, so that
+    jobs can be coordinated (and claims measured) among processes on a single
+    host without AWS. The database is in WAL mode, so readers don't block the
+    writer.
+    """
+
+    def __init__(self, table_name, filename):
+        self.table_name = table_name
+        self.filename = filename
+        if not re.match(r'^[a-zA-Z0-9_.-]+$', table_name):
+            errorAndExit("the table name can contain only letters, digits, '_', '-' and '.'")
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock() # The connection is shared by the threads of the daemon
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute('CREATE TABLE IF NOT EXISTS "%s" (job_id TEXT NOT NULL, counter INTEGER NOT NULL, '
+                        'attrs TEXT NOT NULL, PRIMARY KEY (job_id, counter))' % self.table_name)
+
+    def __repr__(self):
+        return "SQLiteBackend(%s, %s)" % (self.filename, self.table_name)
+
+    def last_execution(self, job_id, metrics=None):
+        with (metrics or Metrics()).phase('query'), self.lock:
+            row = self.db.execute('SELECT counter, attrs FROM "%s" WHERE job_id = ? ORDER BY counter DESC LIMIT 1'
+                                  % self.table_name, (job_id,)).fetchone()
+        if row is None:
+            return None
+        return self.item(job_id, *row)
+
+    def insert_execution(self, job_id, counter, attrs, metrics=None):
+        try:
+            with (metrics or Metrics()).phase('put'), self.lock:
+                self.db.execute('INSERT INTO "%s" (job_id, counter, attrs) VALUES (?, ?, ?)' % self.table_name,
+                                (job_id, counter, json.dumps(attrs)))
+        except sqlite3.IntegrityError as e:
+            # Only an existing execution means that the claim is lost, other errors (e.g. a locked database) are raised
+            logger.debug("IntegrityError: %s" % e)
+            return False
+        return True
+
+    def claim_lease(self, job_id, now, cutoff, attrs, metrics=None):
+        with (metrics or Metrics()).phase('update_lease'), self.lock:
+            # Taking the write lock first, no other process can change the lease until commit
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute('SELECT attrs FROM "%s" WHERE job_id = ? AND counter = 0'
+                                      % self.table_name, (job_id,)).fetchone()
+                lease = json.loads(row[0]) if row else {}
+                if 'lease_time' in lease and (lease['lease_time'] >= cutoff or lease.get('lease_expires', 0) >= now):
+                    self.db.execute("ROLLBACK")
+                    return None
+                lease.update(attrs)
+                lease['lease_time'] = now
+                lease['executions'] = lease.get('executions', 0) + 1
+                self.db.execute('INSERT OR REPLACE INTO "%s" (job_id, counter, attrs) VALUES (?, 0, ?)'
+                                % self.table_name, (job_id, json.dumps(lease)))
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+        return lease['executions']
+
+    def update_lease(self, job_id, node, lease_time, attrs, metrics=None):
+        with (metrics or Metrics()).phase('update_lease'), self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute('SELECT attrs FROM "%s" WHERE job_id = ? AND counter = 0'
+                                      % self.table_name, (job_id,)).fetchone()
+                lease = json.loads(row[0]) if row else {}
+                # The lease is updated only if it is still owned by the node
+                if lease.get('lease_time') != lease_time or lease.get('node') != node:
+                    self.db.execute("ROLLBACK")
+                    return False
+                lease.update(attrs)
+                self.db.execute('UPDATE "%s" SET attrs = ? WHERE job_id = ? AND counter = 0'
+                                % self.table_name, (json.dumps(lease), job_id))
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+        return True
+
+    def update_execution(self, job_id, counter, attrs, metrics=None):
+        try:
+            with (metrics or Metrics()).phase('update'), self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self.db.execute('SELECT attrs FROM "%s" WHERE job_id = ? AND counter = ?'
+                                          % self.table_name, (job_id, counter)).fetchone()
+                    item = json.loads(row[0]) if row else {}
+                    # Only the execution written by the node is updated
+                    if item.get('node') != attrs['node'] or item.get('time') != attrs['time']:
+                        self.db.execute("ROLLBACK")
+                        return False
+                    self.db.execute('UPDATE "%s" SET attrs = ? WHERE job_id = ? AND counter = ?'
+                                    % self.table_name, (json.dumps(attrs), job_id, counter))
+                    self.db.execute("COMMIT")
+                except:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except sqlite3.OperationalError as e:
+            logger.debug("OperationalError: %s" % e)
+            return False
+        return True
+
+    def delete_execution(self, job_id, counter, metrics=None):
+        try:
+            with (metrics or Metrics()).phase('delete'), self.lock:
+                self.db.execute('DELETE FROM "%s" WHERE job_id = ? AND counter = ?' % self.table_name,
+                                (job_id, counter))
+        except sqlite3.OperationalError as e:
+            logger.debug("OperationalError: %s" % e)
+            return False
+        return True
+
+    def executions(self, job_id, metrics=None, page_size=100):
+        """Yields the executions of a job, newest first, reading them a page at a time."""
+        metrics = metrics or Metrics()
+        last_counter = None
+        while True:
+            with metrics.phase('query'), self.lock:
+                if last_counter is None:
+                    rows = self.db.execute('SELECT counter, attrs FROM "%s" WHERE job_id = ? AND counter > 0 '
+                                           'ORDER BY counter DESC LIMIT ?' % self.table_name,
+                                           (job_id, page_size)).fetchall()
+                else:
+                    rows = self.db.execute('SELECT counter, attrs FROM "%s" WHERE job_id = ? AND counter > 0 '
+                                           'AND counter < ? ORDER BY counter DESC LIMIT ?' % self.table_name,
+                                           (job_id, last_counter, page_size)).fetchall()
+            for row in rows:
+                yield self.item(job_id, *row)
+            if len(rows) < page_size:
+                return
+            last_counter = rows[-1][0]
+
+    @staticmethod
+    def item(job_id, counter, attrs):
+        item = json.loads(attrs)
+        item['job_id'] = job_id
+        item['counter'] = counter
+        return item
+
+def get_backend(options, retrier, cache=None, metrics=None):
+    if options.backend == 'sqlite':
+        return SQLiteBackend(options.table, os.path.expanduser(options.db))
+    else:
+        return DynamoDBBackend(options.table, options.region, retrier, cache, metrics)
+
+def dynamodb2_value(value):
+    if isinstance(value, (int, long, float)):
+        return {'N': str(value)}
+    return {'S': value}
+
+class Metrics(object):
+    """Timings and results of an invocation, sent as a single record to a metrics sink.
+
+    Phases are timed (in seconds) with phase(), or with start() and stop().
+    Retries are counted by the Retrier started with these metrics. Without a
+    sink nothing is sent.
+    """
+
+    def __init__(self, sink=None, **fields):
+        self.sink = sink
+        self.fields = fields
+        self.phases = {}
+        self.values = {}
+        self.started = {}
+        self.retries = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def start(self, name):
+        self.started[name] = time.time()
+
+    def stop(self, name):
+        self.phases[name] = self.phases.get(name, 0) + time.time() - self.started.pop(name)
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def add(self, name, value):
+        self.values[name] = self.values.get(name, 0) + value
+
+    def retry(self, name):
+        self.retries[name] = self.retries.get(name, 0) + 1
+
+    def emit(self, now):
+        if self.sink is None:
+            return
+        record = dict(self.fields)
+        record.update(self.values)
+        record['time'] = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+        record['phases'] = dict((name, round(value, 6)) for name, value in self.phases.items())
+        record['retries'] = dict(self.retries)
+        try:
+            self.sink.send(record)
+        except (IOError, socket.error) as e:
+            logger.warning("metrics not sent: %s" % e)
+
+class JSONLinesSink(object):
+    """Metrics sink appending each record as a line of JSON to a file, or to stdout with '-'."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def send(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            if self.filename == '-':
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(self.filename, 'a') as f:
+                    f.write(line)
+
+class StatsDSink(object):
+    """Metrics sink sending each record to a StatsD server over UDP.
+
+    Phases are sent as timers, the outcome, heartbeats, lost leases and
+    retries as counters and the other values as gauges, all prefixed by
+    'runjop.<id>.'.
+    """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, record):
+        prefix = 'runjop.%s.' % re.sub(r'[^a-zA-Z0-9_-]', '_', record['id'])
+        lines = ['%s%s:%i|ms' % (prefix, name, value * 1000) for name, value in sorted(record['phases'].items())]
+        if 'outcome' in record:
+            lines.append('%soutcome.%s:1|c' % (prefix, record['outcome']))
+        for name in ('returncode', 'consumed_capacity', 'bytes_uploaded', 'bytes_spooled'):
+            if name in record:
+                lines.append('%s%s:%s|g' % (prefix, name, record[name]))
+        for name in ('heartbeats', 'leases_lost'):
+            if name in record:
+                lines.append('%s%s:%i|c' % (prefix, name, record[name]))
+        for name, count in sorted(record.get('retries', {}).items()):
+            lines.append('%sretries.%s:%i|c' % (prefix, name, count))
+        self.socket.sendto('\n'.join(lines), self.address)
+
+metrics_sinks = {}
+
+def get_metrics_sink(url):
+    """Returns the sink for a '--metrics' value, the same sink is shared by all the jobs of a daemon."""
+    if url not in metrics_sinks:
+        if url.startswith('udp://'):
+            address = urlparse.urlparse(url)
+            if not address.hostname or not address.port:
+                errorAndExit("The StatsD server must be in udp://HOST:PORT format")
+            metrics_sinks[url] = StatsDSink(address.hostname, address.port)
+        else:
+            metrics_sinks[url] = JSONLinesSink(url)
+    return metrics_sinks[url]
+
+class Heartbeat(threading.Thread):
+    """Renews the lease of a job on an interval while its command is running."""
+
+    def __init__(self, runjop):
+        threading.Thread.__init__(self, name="runjop-heartbeat-%s" % runjop.id)
+        self.daemon = True
+        self.runjop = runjop
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.runjop.heartbeat):
+            self.runjop.renew_lease()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+class Retrier(object):
+    """Retries AWS calls failing because of throttling or transient errors.
+
+    Each retry waits using exponential backoff with full jitter. Retries stop
+    when the deadline (in seconds from the last call to start: when the
+    invocation starts, after its command, and before each part of the output
+    streamed while it runs) would be exceeded, and the last error is raised. The number of retries of each
+    call is counted in 'retries', and in the metrics of the invocation.
+    """
+
+    base = 0.05 # seconds
+    cap = 10 # seconds
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.retries = {}
+        self.lock = threading.Lock()
+        self.local = threading.local() # In the daemon each thread has its own invocations
+        self.start()
+
+    def start(self, metrics=None):
+        self.local.end = time.time() + self.deadline
+        self.local.metrics = metrics
+
+    def call(self, name, function, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except (boto.exception.BotoServerError, socket.error, httplib.HTTPException) as e:
+                if not is_throttling(e):
+                    raise
+                self.backoff(name, attempt, e)
+                attempt += 1
+
+    def backoff(self, name, attempt, error):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        end = getattr(self.local, 'end', None)
+        if end is None:
+            self.start()
+            end = self.local.end
+        if time.time() + delay > end:
+            logger.error("%s failed after %i retries: %s" % (name, attempt, error))
+            raise error
+        with self.lock:
+            self.retries[name] = self.retries.get(name, 0) + 1
+        metrics = getattr(self.local, 'metrics', None)
+        if metrics is not None:
+            metrics.retry(name)
+        logger.debug("%s failed (%s), retry %i in %.2f seconds" % (name, getattr(error, 'error_code', None), attempt + 1, delay))
+        time.sleep(delay)
+
+throttling_errors = set(['ProvisionedThroughputExceededException', 'ThrottlingException', 'Throttling',
+                         'LimitExceededException', 'RequestLimitExceeded', 'SlowDown', 'ServiceUnavailable',
+                         'InternalServerError', 'InternalError', 'RequestTimeout'])
+
+def is_throttling(error):
+    """True if the AWS error is caused by throttling or is transient, so that the call can be retried."""
+    if isinstance(error, boto.https_connection.InvalidCertificateException):
+        return False
+    if isinstance(error, (socket.error, httplib.HTTPException)):
+        return True
+    if getattr(error, 'error_code', None) in throttling_errors:
+        return True
+    message = getattr(error, 'error_message', None) or ''
+    if 'The rate of control plane requests made by this account is too high' in message:
+        return True
+    return (getattr(error, 'status', None) or 0) >= 500
+
+def without_retries(connection):
+    """Turns off the retries of a boto connection, so that its calls are retried
+    (and counted, and stopped at the deadline) only by the Retrier.
+    """
+    connection.num_retries = 0
+    if hasattr(connection, 'NumberRetries'):
+        # DynamoDB retries throttled calls in its retry handler, which raises
+        # the throttling error only when called for the last attempt
+        connection.NumberRetries = 0
+        retry_handler = connection._retry_handler
+        connection._retry_handler = lambda response, i, next_sleep: retry_handler(response, i - 1, next_sleep)
+    return connection
+
+class MetadataCache(object):
+    """On-disk cache of the metadata of DynamoDB tables and S3 buckets.
+
+    Each entry is a small JSON file in the cache directory and is considered
+    valid for 'ttl' seconds after it has been written.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, *key):
+        return os.path.join(self.directory, '-'.join(key) + '.json')
+
+    def get(self, *key):
+        try:
+            with open(self.path(*key)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if time.time() - entry['time'] > self.ttl:
+            logger.debug("cache entry '%s' expired" % '-'.join(key))
+            return None
+        return entry['value']
+
+    def put(self, value, *key):
+        path = self.path(*key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written with a rename, so that concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'time': time.time(), 'value': value}, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.debug("cannot write cache entry '%s': %s" % (path, e))
+
+    def invalidate(self, *key):
+        try:
+            os.remove(self.path(*key))
+        except OSError:
             pass
 
-        logger.debug("put result '%s'" % result)
-        logger.debug("execute_job '%s'" % execute_job)
+class CompressedWriter(object):
+    """Write-only file-like object compressing what is written (with gzip or zstd) before passing it to another writer."""
 
-        if not execute_job:
+    def __init__(self, writer, compression):
+        self.writer = writer
+        if compression == 'zstd':
+            self.compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip format
 
-            logger.info("taken by another node before update")
-            logger.info("command not executed")
+    @property
+    def size(self):
+        return self.writer.size
+
+    def write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.writer.write(compressed)
+
+    def close(self, key_name=None):
+        self.writer.write(self.compressor.flush())
+        self.writer.close(key_name)
+
+    def abort(self):
+        self.writer.abort()
+
+class SpoolWriter(object):
+    """Write-only file-like object writing a log in the spool directory, to be uploaded to S3 later.
+
+    Each log is a data file and a JSON file with its bucket, key and headers.
+    The JSON file is written last, so that the uploader sees only complete logs.
+    """
+
+    def __init__(self, directory, bucket_name, headers):
+        self.directory = directory
+        self.bucket_name = bucket_name
+        self.headers = headers
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Names are sorted by time, so that older logs are uploaded first
+        self.name = '%.6f-%s' % (time.time(), uuid.uuid4().hex)
+        self.path = os.path.join(directory, self.name + '.log')
+        self.file = open(self.path, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self, key_name):
+        self.file.close()
+        tmp_path = os.path.join(self.directory, self.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'bucket': self.bucket_name, 'key': key_name, 'headers': self.headers}, f)
+        os.rename(tmp_path, os.path.join(self.directory, self.name + '.json'))
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+class SpoolUploader(object):
+    """Uploads to S3 the logs in a spool directory, oldest first, reusing the same connection.
+
+    Only one uploader at a time works on a spool directory (using a lock file).
+    Logs that cannot be uploaded stay in the spool and are retried the next time.
+    """
+
+    def __init__(self, directory, retrier):
+        self.directory = directory
+        self.retrier = retrier
+        self.s3 = None
+        self.buckets = {}
+
+    def pending(self):
+        return sorted(glob.glob(os.path.join(self.directory, '*.json')))
+
+    def run(self):
+        if not os.path.isdir(self.directory):
             return
+        failed = set()
+        while True:
+            with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    logger.debug("another uploader is working on '%s'" % self.directory)
+                    return
+                for meta_path in self.pending():
+                    if meta_path not in failed and not self.upload(meta_path):
+                        failed.add(meta_path)
+            # Logs spooled while releasing the lock would be missed by a new uploader
+            if not set(self.pending()) - failed:
+                return
 
-        logger.info("executing command '%s'" % self.command)
-            
+    def upload(self, meta_path):
+        self.retrier.start()
+        data_path = meta_path[:-len('.json')] + '.log'
         try:
-            output = subprocess.check_output(self.command, stderr=subprocess.STDOUT, shell=True)
-            returncode = 0
-        except subprocess.CalledProcessError as e:
-            output = e.output
-            returncode = e.returncode
-            
-        logger.info("returncode = %i" % returncode)
-        logger.info("output:\n%s" % output)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            bucket = self.get_bucket(meta['bucket'])
+            headers = dict((str(name), str(value)) for name, value in meta['headers'].items())
+            writer = S3StreamWriter(bucket, str(meta['key']), self.retrier, headers)
+            with open(data_path, 'rb') as f:
+                try:
+                    while True:
+                        data = f.read(writer.part_size)
+                        if not data:
+                            break
+                        writer.write(data)
+                except:
+                    writer.abort()
+                    raise
+                writer.close()
+        except (IOError, ValueError, boto.exception.BotoServerError) as e:
+            logger.warning("cannot upload '%s': %s" % (data_path, e))
+            return False
+        os.remove(data_path)
+        os.remove(meta_path)
+        logger.info("output written on s3://%s/%s (%i bytes)" % (meta['bucket'], meta['key'], writer.size))
+        return True
 
-	if self.s3_bucket_name:
+    def get_bucket(self, bucket_name):
+        if self.s3 is None:
+            self.s3 = without_retries(boto.connect_s3())
+        if bucket_name not in self.buckets:
+            self.buckets[bucket_name] = self.s3.get_bucket(bucket_name, validate=False)
+        return self.buckets[bucket_name]
 
-            key_name = self.s3_prefix + '-'.join([self.table_name, self.id,
-                                                  now.strftime(self.date_format_s3),
-                                                  self.node, str(returncode)]) + '.log'
-                
-            k = Key(self.s3_bucket)
+class S3StreamWriter(object):
+    """Write-only file-like object sending its content to S3 as a multipart upload.
+
+    At most one part is kept in memory. If less than a part is written the
+    content is sent with a single PUT and no multipart upload is started.
+    """
+
+    part_size = 8 * 1024 * 1024 # S3 requires parts (except the last one) of at least 5 MB
+    copy_size = 5 * 1024 * 1024 * 1024 # Max size of a single S3 copy request
+
+    def __init__(self, bucket, key_name, retrier, headers=None):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.retrier = retrier
+        self.headers = headers or {'Content-Type': 'text/plain'}
+        self.buffer = StringIO()
+        self.multipart = None
+        self.part_num = 0
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.size += len(data)
+        if self.buffer.tell() >= self.part_size:
+            self.flush_part()
+
+    def flush_part(self):
+        if self.multipart is None:
+            self.multipart = self.retrier.call('initiate_multipart', self.bucket.initiate_multipart_upload,
+                                               self.key_name, headers=self.headers)
+            logger.debug("multipart upload '%s' started on '%s'" % (self.multipart.id, self.key_name))
+        self.part_num += 1
+        def upload_part():
+            self.buffer.seek(0)
+            self.multipart.upload_part_from_file(self.buffer, self.part_num)
+        self.retrier.call('upload_part', upload_part)
+        logger.debug("part %i uploaded on '%s'" % (self.part_num, self.key_name))
+        self.buffer = StringIO()
+
+    def close(self, key_name=None):
+        if key_name is None:
+            key_name = self.key_name
+        if self.multipart is None:
+            k = Key(self.bucket)
             k.key = key_name
-            content = '\n'.join(["command:", self.command, "output:", output])
-            k.set_contents_from_string(content, headers={'Content-Type': 'text/plain'})
-            logger.info("output written on s3://%s/%s" % (self.s3_bucket_name, key_name))
+            self.retrier.call('set_contents', k.set_contents_from_string, self.buffer.getvalue(), headers=self.headers)
+        else:
+            if self.buffer.tell() > 0:
+                self.flush_part()
+            self.retrier.call('complete_multipart', self.multipart.complete_upload)
+            if key_name != self.key_name:
+                self.rename(key_name)
+        self.buffer = StringIO()
+
+    def abort(self):
+        if self.multipart is not None:
+            self.retrier.call('cancel_multipart', self.multipart.cancel_upload)
+            logger.debug("multipart upload '%s' cancelled" % self.multipart.id)
+        self.buffer = StringIO()
+
+    def rename(self, key_name):
+        if self.size <= self.copy_size:
+            self.retrier.call('copy_key', self.bucket.copy_key, key_name, self.bucket.name, self.key_name, headers=self.headers)
+        else:
+            multipart = self.retrier.call('initiate_multipart', self.bucket.initiate_multipart_upload,
+                                          key_name, headers=self.headers)
+            part_num = 0
+            for start in range(0, self.size, self.copy_size):
+                part_num += 1
+                end = min(start + self.copy_size, self.size) - 1
+                self.retrier.call('copy_part', multipart.copy_part_from_key,
+                                  self.bucket.name, self.key_name, part_num, start, end)
+            self.retrier.call('complete_multipart', multipart.complete_upload)
+        self.retrier.call('delete_key', self.bucket.delete_key, self.key_name)
+        logger.debug("'%s' renamed to '%s'" % (self.key_name, key_name))
+
+class CronSchedule(object):
+    """A crontab-style schedule: minute, hour, day of month, month and day of week.
+
+    Each field supports '*', single values, ranges ('a-b'), steps ('*/n', 'a-b/n')
+    and comma separated lists of them.
+    """
+
+    fields = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        values = expression.split()
+        if len(values) != len(self.fields):
+            raise ValueError("a schedule must have 5 fields: '%s'" % expression)
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = [
+            self.parse_field(value, low, high) for value, (low, high) in zip(values, self.fields)]
+        if 7 in self.weekdays: # Both 0 and 7 are Sunday
+            self.weekdays.add(0)
+        self.any_day = values[2] == '*'
+        self.any_weekday = values[4] == '*'
+
+    @staticmethod
+    def parse_field(value, low, high):
+        result = set()
+        for item in value.split(','):
+            if '/' in item:
+                item, step = item.split('/', 1)
+                step = int(step)
+            else:
+                step = 1
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = [int(v) for v in item.split('-', 1)]
+            else:
+                start = end = int(item)
+                if step > 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError("invalid schedule field '%s'" % value)
+            result.update(range(start, end + 1, step))
+        return result
+
+    def matches(self, when):
+        if when.minute not in self.minutes or when.hour not in self.hours or when.month not in self.months:
+            return False
+        day = when.day in self.days
+        weekday = (when.weekday() + 1) % 7 in self.weekdays
+        # Same as cron: if both day fields are restricted, either one can match
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+def load_manifest(filename):
+    with open(filename) as f:
+        content = f.read()
+    if filename.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            errorAndExit("PyYAML is required to read a YAML manifest")
+        manifest = yaml.safe_load(content)
+    else:
+        manifest = json.loads(content)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('jobs')
+    if not isinstance(manifest, list):
+        errorAndExit("the manifest must contain a list of jobs")
+    return manifest
+
+class Daemon(object):
+    """Long-running scheduler for all the jobs in a manifest.
+
+    All jobs share the same DynamoDB table and S3 bucket handles. Every minute
+    the jobs that are due are claimed by a bounded pool of claimer threads, so
+    that a slow claim doesn't delay the others, and the claimed ones are
+    executed by a bounded pool of worker threads.
+    """
+
+    upload_interval = 10 # seconds
+
+    job_options = ['id', 'command', 'range', 's3log', 'stream', 'tail', 'engine', 'keep', 'max_age', 'compress',
+                   'heartbeat']
+
+    def __init__(self, options):
+        logger.debug("Daemon.__init__ '%s'" % options)
+
+        if options.workers > 0:
+            self.workers = int(options.workers)
+        else:
+            errorAndExit("the number of workers must be greater than 0")
+
+        if options.claimers > 0:
+            self.claimers = int(options.claimers)
+        else:
+            errorAndExit("the number of claimers must be greater than 0")
+
+        self.jobs = []
+        backend = None
+        buckets = {}
+        self.retrier = Retrier(options.retry_deadline)
+
+        for job in load_manifest(options.manifest):
+            job_options = copy.copy(options)
+            for name, value in job.items():
+                if name == 'schedule':
+                    continue
+                if name not in self.job_options:
+                    errorAndExit("unknown option '%s' for job '%s' in the manifest" % (name, job.get('id')))
+                setattr(job_options, name, value)
+            try:
+                schedule = CronSchedule(job.get('schedule', ''))
+            except ValueError as e:
+                errorAndExit("%s for job '%s' in the manifest" % (e, job.get('id')))
+            runjop = RunJOP(job_options, backend=backend, s3_buckets=buckets, retrier=self.retrier)
+            runjop.spawn_uploader = False
+            backend = runjop.backend
+            self.jobs.append((schedule, runjop))
+            logger.info("job '%s' scheduled at '%s'" % (runjop.id, schedule.expression))
+
+        if not self.jobs:
+            errorAndExit("no jobs found in the manifest")
+
+        if options.spool:
+            self.uploader = SpoolUploader(os.path.expanduser(options.spool), Retrier(options.retry_deadline))
+        else:
+            self.uploader = None
+
+        self.claims = Queue.Queue()
+        self.queue = Queue.Queue()
+        self.running = set() # Jobs being claimed or executed on this node
+        self.running_lock = threading.Lock()
+        self.stopping = False
+
+    def run(self):
+        claimers = []
+        for i in range(self.claimers):
+            thread = threading.Thread(target=self.claimer, name="runjop-claimer-%i" % i)
+            thread.daemon = True
+            thread.start()
+            claimers.append(thread)
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, name="runjop-worker-%i" % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        if self.uploader:
+            thread = threading.Thread(target=self.upload, name="runjop-uploader")
+            thread.daemon = True
+            thread.start()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        next_tick = self.next_minute(datetime.datetime.now())
+        while not self.stopping:
+            wait = (next_tick - datetime.datetime.now()).total_seconds()
+            if wait > 0:
+                time.sleep(min(wait, 1))
+                continue
+            self.tick(next_tick)
+            next_tick = self.next_tick(next_tick, datetime.datetime.now())
+
+        logger.info("waiting for running jobs to complete")
+        for thread in claimers:
+            self.claims.put(None)
+        for thread in claimers:
+            while thread.is_alive():
+                thread.join(1)
+        for thread in threads:
+            self.queue.put(None)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+
+    def tick(self, when):
+        logger.debug("tick '%s'" % when)
+        for schedule, runjop in self.jobs:
+            if not schedule.matches(when):
+                continue
+            with self.running_lock:
+                if runjop.id in self.running:
+                    logger.info("job '%s' still claimed or running on this node, not claimed" % runjop.id)
+                    continue
+                self.running.add(runjop.id)
+            self.claims.put(runjop)
+
+    def claimer(self):
+        while True:
+            runjop = self.claims.get()
+            if runjop is None:
+                return
+            now = datetime.datetime.utcnow()
+            runjop.metrics = runjop.new_metrics()
+            self.retrier.start(runjop.metrics)
+            try:
+                claimed = runjop.claim(now)
+            except Exception:
+                logger.exception("claim of job '%s' failed" % runjop.id)
+                runjop.metrics.set('outcome', 'error')
+                claimed = False
+            if claimed:
+                self.queue.put((runjop, now))
+            else:
+                runjop.metrics.emit(now)
+                with self.running_lock:
+                    self.running.discard(runjop.id)
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            runjop, now = item
+            self.retrier.start(runjop.metrics)
+            try:
+                runjop.execute(now)
+            except Exception:
+                logger.exception("execution of job '%s' failed" % runjop.id)
+                runjop.metrics.set('outcome', 'error')
+            finally:
+                runjop.metrics.emit(now)
+                with self.running_lock:
+                    self.running.discard(runjop.id)
+
+    def upload(self):
+        while not self.stopping:
+            try:
+                self.uploader.run()
+            except Exception:
+                logger.exception("upload of the spooled logs failed")
+            time.sleep(self.upload_interval)
+
+    def stop(self, signum, frame):
+        logger.info("signal %i received, stopping" % signum)
+        self.stopping = True
+
+    @staticmethod
+    def next_minute(when):
+        return when.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+
+    def next_tick(self, tick, now):
+        # A late tick is still run in its minute, the ones whose minute is over are skipped
+        next_tick = self.next_minute(tick)
+        skipped = []
+        while self.next_minute(next_tick) <= now:
+            skipped.append(next_tick)
+            next_tick = self.next_minute(next_tick)
+        if skipped:
+            logger.warning("%i ticks skipped, from '%s' to '%s': the jobs due in them are not claimed"
+                           % (len(skipped), skipped[0], skipped[-1]))
+        return next_tick
+
+class History(object):
+    """Reads and prunes the executions of a job stored in the backend."""
+
+    date_formats = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+
+    def __init__(self, options):
+        logger.debug("History.__init__ '%s'" % options)
+
+        self.date_format_db = '%Y-%m-%d %H:%M:%S'
+
+        if not options.table:
+            errorAndExit("a table with the executions of the jobs must be provided")
+
+        if options.id:
+            self.id = options.id
+        else:
+            errorAndExit("the ID of the job must be provided")
+
+        self.node = options.node
+
+        self.since = None
+        if options.since:
+            for date_format in self.date_formats:
+                try:
+                    self.since = datetime.datetime.strptime(options.since, date_format)
+                    break
+                except ValueError:
+                    pass
+            else:
+                errorAndExit("the since date must be in 'YYYY-MM-DD[ HH:MM:SS]' format")
+
+        if options.limit >= 0:
+            self.limit = int(options.limit)
+        else:
+            errorAndExit("the limit must not be negative")
+
+        if options.keep >= 0:
+            self.keep = int(options.keep)
+        else:
+            errorAndExit("the number of executions to keep must not be negative")
+
+        if options.max_age >= 0:
+            self.max_age = int(options.max_age)
+        else:
+            errorAndExit("the max age (in seconds) of executions must not be negative")
+
+        cache = MetadataCache(os.path.expanduser(options.cache_dir), options.cache_ttl) if options.cache_ttl > 0 else None
+        self.backend = get_backend(options, Retrier(options.retry_deadline), cache)
+
+    def executions(self):
+        # Executions are read newest first, so the ones before 'since' are the last
+        for item in self.backend.executions(self.id):
+            if self.since and datetime.datetime.strptime(item['time'], self.date_format_db) < self.since:
+                return
+            if self.node and item.get('node') != self.node:
+                continue
+            yield item
+
+    def show(self):
+        columns = ['counter', 'time', 'node', 'finish', 'duration', 'returncode']
+        sys.stdout.write('\t'.join(columns) + '\n')
+        for count, item in enumerate(self.executions()):
+            if self.limit and count >= self.limit:
+                break
+            sys.stdout.write('\t'.join(str(item.get(column, '-')) for column in columns) + '\n')
+
+    def prune(self):
+        if not self.keep and not self.max_age:
+            errorAndExit("the number of executions to keep or their max age must be provided")
+        now = datetime.datetime.utcnow()
+        now_epoch = calendar.timegm(now.utctimetuple())
+        deleted = 0
+        for position, item in enumerate(self.backend.executions(self.id)):
+            # The last execution is always kept, it is used to check the range
+            if position == 0:
+                continue
+            age = (now - datetime.datetime.strptime(item['time'], self.date_format_db)).total_seconds()
+            if ((self.keep and position >= self.keep) or (self.max_age and age > self.max_age) or
+                    item.get('expires', now_epoch) < now_epoch):
+                logger.debug("deleting execution %s of '%s'" % (item['counter'], self.id))
+                if self.backend.delete_execution(self.id, item['counter']):
+                    deleted += 1
+        logger.info("%i executions of '%s' deleted" % (deleted, self.id))
 
 def errorAndExit(error, exitCode=1):
     logger.error(error + ", use -h for help.")
     exit(exitCode)
 
-def main():
+def get_parser():
     description = """RunJOP (Run Just Once Please) is a distributed execution framework
 to run a command (i.e. a job) only once in a group of servers
 and can be used together with UNIX/Linux cron to put a crontab schedule in High Availability (HA)."""
@@ -218,15 +1785,20 @@ access to DynamoDB/S3 resources."""
 
     parser = argparse.ArgumentParser(epilog=epilog, description=description)
 
+    parser.add_argument("action", nargs="?", choices=['run', 'history', 'prune', 'upload'], default='run',
+            help="'run' the command (default), show the 'history' of the executions of a job, "
+                 "'prune' its old executions (using --keep and/or --max-age), "
+                 "or 'upload' the logs in the --spool directory")
+
     required_group = parser.add_argument_group("required arguments")
-    required_group.add_argument("--table", action="store", required=True,
+    required_group.add_argument("--table", action="store",
             help="DynamoDB table to use for concurrency checks and log job execution.")
     required_group.add_argument("--id", action="store",
-            help="The Unique ID for identifying this job across multiple servers.")
-    required_group.add_argument("--node", action="store", default=socket.gethostname(),
-            help="Identifies the particular node; defaults to the hostname.")
-    required_group.add_argument("--command", metavar="COMMAND", required=True,
-            help="The specified command will be run on only once.")
+            help="The Unique ID for identifying this job across multiple servers (not used with --manifest).")
+    required_group.add_argument("--node", action="store",
+            help="Identifies the particular node; defaults to the hostname (with 'history' shows only the executions on this node).")
+    required_group.add_argument("--command", metavar="COMMAND",
+            help="The specified command will be run on only once (not used with --manifest).")
 
     parser.add_argument("--region", action="store", default="us-east-1",
             help="AWS region to use for DynamoDB")
@@ -236,12 +1808,58 @@ access to DynamoDB/S3 resources."""
             help="the range of time (in seconds) in which the execution of the job must be unique")
     parser.add_argument("--s3log", metavar="s3://BUCKET[/PATH]",
             help="S3 path to put the output of the job.")
+    parser.add_argument("--stream", action="store_true", default=False,
+            help="stream the output of the job to S3 while it runs, keeping only its tail in the local log")
+    parser.add_argument("--tail", metavar="BYTES", type=int, default=64*1024,
+            help="how much of the output is written in the local log when streaming (default is 65536 bytes)")
+    parser.add_argument("--compress", choices=['gzip', 'zstd'],
+            help="compress the output of the job before sending it to S3 (with the matching Content-Encoding)")
+    parser.add_argument("--spool", metavar="DIR",
+            help="write the output of the job in DIR and upload it to S3 in the background, without waiting for it")
+    parser.add_argument("--manifest", metavar="FILE",
+            help="run as a daemon, scheduling all the jobs in the JSON (or YAML) file using their cron-style 'schedule'")
+    parser.add_argument("--workers", metavar="N", type=int, default=4,
+            help="how many jobs can be executed at the same time with --manifest (default is 4)")
+    parser.add_argument("--claimers", metavar="N", type=int, default=8,
+            help="how many jobs can be claimed at the same time with --manifest (default is 8)")
+    parser.add_argument("--engine", choices=['query', 'lease'], default='query',
+            help="how the job is claimed: 'query' reads the last execution and then writes the next one, "
+                 "'lease' uses a single conditional write on a lease item per job (default is 'query')")
+    parser.add_argument("--heartbeat", metavar="S", type=int, default=0,
+            help="with '--engine lease', renew the lease every S seconds while the job is running and release it at the end: "
+                 "other nodes consider the job busy until heartbeats stop, so the range can be shorter than the job (default is 0, no heartbeat)")
+    parser.add_argument("--backend", choices=['dynamodb', 'sqlite'], default='dynamodb',
+            help="where executions are stored to check concurrency: a DynamoDB table, or a table in a local "
+                 "SQLite database to coordinate processes on a single host (default is 'dynamodb')")
+    parser.add_argument("--db", metavar="FILE", default="~/.runjop/runjop.db",
+            help="the SQLite database used with '--backend sqlite' (default is ~/.runjop/runjop.db)")
+    parser.add_argument("--retry-deadline", metavar="S", type=int, default=60, dest="retry_deadline",
+            help="for how long AWS calls failing because of throttling are retried, with exponential backoff and jitter (default is 60 seconds)")
+    parser.add_argument("--metrics", metavar="FILE|udp://HOST:PORT",
+            help="write the timing of each phase and the result of every invocation as a JSON line in FILE "
+                 "('-' for stdout), or send them to a StatsD server")
+    parser.add_argument("--keep", metavar="N", type=int, default=0,
+            help="keep only the last N executions of the job in the table (default is 0, keep all)")
+    parser.add_argument("--max-age", metavar="S", type=int, default=0, dest="max_age",
+            help="executions older than S seconds can be deleted: they are marked with an 'expires' attribute "
+                 "that can be used as the DynamoDB TTL, and removed by 'prune' (default is 0, never)")
+    parser.add_argument("--since", metavar="DATE",
+            help="with 'history', show only the executions started from DATE (UTC, in 'YYYY-MM-DD[ HH:MM:SS]' format)")
+    parser.add_argument("--limit", metavar="N", type=int, default=0,
+            help="with 'history', show at most N executions (default is 0, no limit)")
+    parser.add_argument("--cache-ttl", metavar="S", type=int, default=0, dest="cache_ttl",
+            help="cache the DynamoDB table and S3 bucket metadata on disk for S seconds, skipping their discovery (default is 0, no cache)")
+    parser.add_argument("--cache-dir", metavar="DIR", default="~/.runjop", dest="cache_dir",
+            help="the directory used for the metadata cache (default is ~/.runjop)")
     parser.add_argument("--log", metavar="FILE", dest="logfile",
             help="Local filename to use for the log.")
     parser.add_argument("--debug", action="store_true", default=False,
             help="print debug information")
 
-    options = parser.parse_args()
+    return parser
+
+def main():
+    options = get_parser().parse_args()
 
     if options.logfile:
         logHandler = logging.handlers.RotatingFileHandler(options.logfile, maxBytes=1024*1024, backupCount=10)
@@ -250,7 +1868,25 @@ access to DynamoDB/S3 resources."""
     if options.debug:
         logging.setLevel(logging.DEBUG)
 
-    RunJOP(options).run()
+    if options.action == 'history':
+        History(options).show()
+        return
+    elif options.action == 'prune':
+        History(options).prune()
+        return
+    elif options.action == 'upload':
+        if not options.spool:
+            errorAndExit("the spool directory must be provided")
+        SpoolUploader(os.path.expanduser(options.spool), Retrier(options.retry_deadline)).run()
+        return
+
+    if not options.node:
+        options.node = socket.gethostname()
+
+    if options.manifest:
+        Daemon(options).run()
+    else:
+        RunJOP(options).run()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,235 @@
+"""Local stand-ins for the AWS services used by runjop, for tests and benchmarks."""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import runjop
+import boto.dynamodb.layer1
+import boto.dynamodb.exceptions
+import boto.s3.connection
+
+runjop.logger.setLevel(logging.WARNING)
+
+def options(*args):
+    """Returns the options of a job as parsed from the command line, with defaults for the required ones."""
+    return runjop.get_parser().parse_args(['--table', 't', '--id', 'j', '--node', 'n', '--command', 'true'] + list(args))
+
+@contextlib.contextmanager
+def patched(obj, name, value):
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+class LocalControlPlane(object):
+    """Stand-in for the control plane calls made when a job starts: DescribeTable
+    for the DynamoDB table and the validation of the S3 bucket.
+
+    Every call waits 'latency' seconds and is counted in 'calls'.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = {}
+
+    def call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @contextlib.contextmanager
+    def installed(self):
+        control_plane = self
+        def describe_table(layer1, table_name):
+            control_plane.call('describe_table')
+            return {'Table': {'TableName': table_name, 'TableStatus': 'ACTIVE',
+                              'KeySchema': {'HashKeyElement': {'AttributeName': 'job_id', 'AttributeType': 'S'},
+                                            'RangeKeyElement': {'AttributeName': 'counter', 'AttributeType': 'N'}},
+                              'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}}}
+        def head_bucket(connection, bucket_name, headers=None):
+            control_plane.call('head_bucket')
+            return connection.bucket_class(connection, bucket_name)
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+        with patched(boto.dynamodb.layer1.Layer1, 'describe_table', describe_table), \
+                patched(boto.s3.connection.S3Connection, 'head_bucket', head_bucket):
+            yield self
+
+class LocalDynamoDB(object):
+    """Stand-in for the DynamoDB data plane, answering the requests of boto's
+    Layer1 (Query, GetItem, PutItem and DeleteItem) from memory.
+
+    Every request waits 'latency' seconds and is counted in 'calls', by action.
+    """
+
+    conditional_check_failed = 'com.amazonaws.dynamodb.v20111205#ConditionalCheckFailedException'
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = {}
+        self.items = {} # job_id -> {counter: item}
+        self.lock = threading.Lock()
+
+    def request(self, action, data):
+        with self.lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return getattr(self, action.lower())(data)
+
+    def rows(self, hash_key):
+        return self.items.setdefault(hash_key['S'], {})
+
+    def check(self, item, expected):
+        for name, condition in (expected or {}).items():
+            if condition.get('Exists', True) is False and name in (item or {}) \
+                    or 'Value' in condition and (item or {}).get(name) != condition['Value']:
+                raise boto.dynamodb.exceptions.DynamoDBConditionalCheckFailedError(400, 'Bad Request', {
+                    '__type': self.conditional_check_failed, 'message': 'The conditional request failed'})
+
+    def query(self, data):
+        rows = self.rows(data['HashKeyValue'])
+        counters = sorted(rows, reverse=not data.get('ScanIndexForward', True))
+        condition = data.get('RangeKeyCondition')
+        if condition:
+            # Only the comparison used by runjop
+            assert condition['ComparisonOperator'] == 'GT'
+            counters = [c for c in counters if c > float(condition['AttributeValueList'][0]['N'])]
+        items = [rows[c] for c in counters][:data.get('Limit')]
+        return {'Items': items, 'Count': len(items), 'ConsumedCapacityUnits': 1}
+
+    def getitem(self, data):
+        item = self.rows(data['Key']['HashKeyElement']).get(float(data['Key']['RangeKeyElement']['N']))
+        return {'Item': item, 'ConsumedCapacityUnits': 1} if item else {'ConsumedCapacityUnits': 1}
+
+    def putitem(self, data):
+        item = data['Item']
+        rows = self.rows(item['job_id'])
+        counter = float(item['counter']['N'])
+        self.check(rows.get(counter), data.get('Expected'))
+        rows[counter] = item
+        return {'ConsumedCapacityUnits': 1}
+
+    def deleteitem(self, data):
+        self.rows(data['Key']['HashKeyElement']).pop(float(data['Key']['RangeKeyElement']['N']), None)
+        return {'ConsumedCapacityUnits': 1}
+
+    @contextlib.contextmanager
+    def installed(self):
+        dynamodb = self
+        def make_request(layer1, action, body='', object_hook=None):
+            return json.loads(json.dumps(dynamodb.request(action, json.loads(body))), object_hook=object_hook)
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+        with patched(boto.dynamodb.layer1.Layer1, 'make_request', make_request):
+            yield self
+
+class LocalBucket(object):
+    """Stand-in for a boto S3 bucket, keeping each key as a file in a directory.
+
+    Every request waits 'latency' seconds, and requests and bytes sent are
+    counted, so that uploads can be measured without S3. The next requests
+    fail with the errors in 'errors', if any.
+    """
+
+    def __init__(self, directory, name='bucket', latency=0):
+        self.directory = directory
+        self.name = name
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self.headers = {}
+        self.errors = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def request(self, size=0):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.bytes_sent += size
+
+    def path(self, key_name):
+        return os.path.join(self.directory, key_name.replace('/', '%2F'))
+
+    def keys(self):
+        return sorted(name.replace('%2F', '/') for name in os.listdir(self.directory) if not name.startswith('.'))
+
+    def read(self, key_name):
+        with open(self.path(key_name), 'rb') as f:
+            return f.read()
+
+    def set_contents(self, key_name, data, headers=None):
+        self.request(len(data))
+        with open(self.path(key_name), 'wb') as f:
+            f.write(data)
+        self.headers[key_name] = headers
+
+    def initiate_multipart_upload(self, key_name, headers=None):
+        self.request()
+        return LocalMultipartUpload(self, key_name, headers)
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name, headers=None):
+        self.request()
+        shutil.copyfile(self.path(src_key_name), self.path(new_key_name))
+        self.headers[new_key_name] = headers or self.headers.get(src_key_name)
+
+    def delete_key(self, key_name):
+        self.request()
+        os.remove(self.path(key_name))
+        self.headers.pop(key_name, None)
+
+class LocalMultipartUpload(object):
+
+    def __init__(self, bucket, key_name, headers):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.headers = headers
+        self.id = uuid.uuid4().hex
+        self.parts = {}
+
+    def upload_part_from_file(self, fp, part_num, headers=None):
+        path = os.path.join(self.bucket.directory, '.%s-%i' % (self.id, part_num))
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(fp, f)
+            size = f.tell()
+        self.bucket.request(size)
+        self.parts[part_num] = path
+
+    def complete_upload(self):
+        self.bucket.request()
+        with open(self.bucket.path(self.key_name), 'wb') as f:
+            for part_num in sorted(self.parts):
+                with open(self.parts[part_num], 'rb') as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(self.parts[part_num])
+        self.bucket.headers[self.key_name] = self.headers
+
+    def cancel_upload(self):
+        self.bucket.request()
+        for path in self.parts.values():
+            os.remove(path)
+
+class LocalKey(object):
+    """Stand-in for boto.s3.key.Key, to be patched in runjop with LocalBucket."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.key = None
+
+    def set_contents_from_string(self, data, headers=None):
+        self.bucket.set_contents(self.key, data, headers)
@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+import unittest
+
+import boto.exception
+
+from tests.stand_ins import runjop, options, LocalControlPlane
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = options('--s3log', 's3://bucket/logs', '--cache-ttl', '3600', '--cache-dir', self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_warm_invocation_skips_control_plane(self):
+        with LocalControlPlane().installed() as control_plane:
+            runjop.RunJOP(self.options)
+            self.assertEqual(control_plane.calls, {'describe_table': 2, 'head_bucket': 1})
+            control_plane.calls = {}
+            job = runjop.RunJOP(self.options)
+            self.assertEqual(control_plane.calls, {})
+        self.assertEqual(job.backend.table.schema.hash_key_name, 'job_id')
+        self.assertEqual(job.backend.table.schema.range_key_name, 'counter')
+
+    def test_resource_not_found_invalidates_cache(self):
+        with LocalControlPlane().installed() as control_plane:
+            runjop.RunJOP(self.options)
+            job = runjop.RunJOP(self.options)
+            control_plane.calls = {}
+            attempts = []
+            def operation(metrics):
+                attempts.append(job.backend.table)
+                if len(attempts) == 1:
+                    raise boto.exception.JSONResponseError(400, 'Bad Request', body={
+                        '__type': 'com.amazonaws.dynamodb.v20111205#ResourceNotFoundException'})
+                return 'done'
+            self.assertEqual(job.backend.call(operation, runjop.Metrics()), 'done')
+            self.assertEqual(control_plane.calls, {'describe_table': 2})
+            self.assertIsNot(attempts[0], attempts[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import time
+import shutil
+import sqlite3
+import datetime
+import tempfile
+import unittest
+import multiprocessing
+
+from tests.stand_ins import runjop, options
+
+class ClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = os.path.join(self.directory, 'runjop.db')
+        self.now = datetime.datetime(2024, 1, 1, 10, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def job(self, node, *args):
+        return runjop.RunJOP(options('--backend', 'sqlite', '--db', self.db, '--node', node, '--range', '60', *args))
+
+    def at(self, minutes):
+        return self.now + datetime.timedelta(minutes=minutes)
+
+    def test_switch_from_query_to_lease_engine(self):
+        self.assertTrue(self.job('a').claim(self.at(0)))
+        self.assertTrue(self.job('b').claim(self.at(2)))
+        job = self.job('c', '--engine', 'lease')
+        self.assertTrue(job.claim(self.at(4)))
+        self.assertEqual(job.counter, 3)
+        self.assertTrue(self.job('d', '--engine', 'lease').claim(self.at(6)))
+        history = [(item['counter'], item['node']) for item in job.backend.executions('j')]
+        self.assertEqual(history, [(4, 'd'), (3, 'c'), (2, 'b'), (1, 'a')])
+
+    def test_completion_updates_only_own_execution(self):
+        job = self.job('a')
+        self.assertTrue(job.claim(self.at(0)))
+        other = {'node': 'b', 'time': '2024-01-01 10:00:00', 'returncode': 1}
+        self.assertFalse(job.backend.update_execution('j', 1, other))
+        self.assertFalse(job.backend.update_execution('j', 2, other))
+        job.complete(self.at(0), 0)
+        history = [(item['counter'], item['node'], item.get('returncode')) for item in job.backend.executions('j')]
+        self.assertEqual(history, [(1, 'a', 0)])
+
+    def test_locked_database_is_not_a_lost_race(self):
+        job = self.job('a')
+        job.backend.db = sqlite3.connect(self.db, timeout=0.1, isolation_level=None)
+        lock = sqlite3.connect(self.db, isolation_level=None)
+        lock.execute("BEGIN IMMEDIATE")
+        try:
+            self.assertRaises(sqlite3.OperationalError, job.claim, self.at(0))
+            lease = self.job('b', '--engine', 'lease')
+            lease.backend.db = job.backend.db
+            self.assertRaises(sqlite3.OperationalError, lease.claim, self.at(0))
+        finally:
+            lock.execute("ROLLBACK")
+
+def claim(args):
+    db, engine, node, job_ids, when, start_at = args
+    backend = None
+    jobs = []
+    for job_id in job_ids:
+        jobs.append(runjop.RunJOP(options('--backend', 'sqlite', '--db', db, '--node', node, '--id', job_id,
+                                          '--range', '60', '--engine', engine), backend=backend))
+        backend = jobs[-1].backend
+    time.sleep(max(0, start_at - time.time()))
+    return [(job.id, job.claim(when)) for job in jobs]
+
+class ContentionTest(unittest.TestCase):
+    """Nodes in concurrent processes claim the same jobs, exactly one must win each job in each window."""
+
+    nodes = 16
+    windows = 3
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = multiprocessing.Pool(self.nodes)
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.pool.join()
+        shutil.rmtree(self.directory)
+
+    def race(self, engine, job_ids):
+        db = os.path.join(self.directory, '%s.db' % engine)
+        now = datetime.datetime(2024, 1, 1, 10, 0)
+        for window in range(self.windows):
+            when = now + datetime.timedelta(minutes=2 * window)
+            start_at = time.time() + 0.5
+            results = self.pool.map(claim, [(db, engine, 'node-%i' % i, job_ids, when, start_at)
+                                            for i in range(self.nodes)])
+            winners = dict((job_id, 0) for job_id in job_ids)
+            for node_results in results:
+                for job_id, won in node_results:
+                    winners[job_id] += won
+            self.assertEqual(winners, dict((job_id, 1) for job_id in job_ids))
+
+    def test_query_engine_one_job(self):
+        self.race('query', ['j'])
+
+    def test_lease_engine_one_job(self):
+        self.race('lease', ['j'])
+
+    def test_query_engine_many_jobs(self):
+        self.race('query', ['job-%i' % i for i in range(20)])
+
+    def test_lease_engine_many_jobs(self):
+        self.race('lease', ['job-%i' % i for i in range(20)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from tests.stand_ins import runjop, options
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        manifest = os.path.join(self.directory, 'jobs.json')
+        with open(manifest, 'w') as f:
+            json.dump({'jobs': [{'id': 'job-%i' % i, 'schedule': '* * * * *', 'command': 'true'} for i in range(4)]}, f)
+        self.daemon = runjop.Daemon(options('--backend', 'sqlite', '--db', os.path.join(self.directory, 'runjop.db'),
+                                            '--manifest', manifest, '--claimers', '4'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_slow_claim_does_not_delay_the_others(self):
+        slow = self.daemon.jobs[0][1]
+        claim = slow.claim
+        def slow_claim(now):
+            time.sleep(1)
+            return claim(now)
+        slow.claim = slow_claim
+        for i in range(self.daemon.claimers):
+            thread = runjop.threading.Thread(target=self.daemon.claimer)
+            thread.daemon = True
+            thread.start()
+        started = time.time()
+        self.daemon.tick(datetime.datetime.now())
+        claimed = [self.daemon.queue.get(timeout=5)[0].id for i in range(3)]
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(sorted(claimed), ['job-1', 'job-2', 'job-3'])
+        self.assertEqual(self.daemon.queue.get(timeout=5)[0].id, 'job-0')
+
+    def test_job_being_claimed_is_not_claimed_again(self):
+        when = datetime.datetime.now()
+        self.daemon.tick(when)
+        self.daemon.tick(when)
+        self.assertEqual(self.daemon.claims.qsize(), 4)
+
+    def test_next_tick(self):
+        tick = datetime.datetime(2024, 1, 1, 10, 0)
+        self.assertEqual(self.daemon.next_tick(tick, tick + datetime.timedelta(seconds=10)),
+                         datetime.datetime(2024, 1, 1, 10, 1))
+        # A late tick is still run in its minute
+        self.assertEqual(self.daemon.next_tick(tick, tick + datetime.timedelta(seconds=80)),
+                         datetime.datetime(2024, 1, 1, 10, 1))
+        # The ones whose minute is over are skipped
+        self.assertEqual(self.daemon.next_tick(tick, tick + datetime.timedelta(seconds=190)),
+                         datetime.datetime(2024, 1, 1, 10, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import datetime
+import tempfile
+import unittest
+import subprocess
+
+from tests.stand_ins import runjop, options
+
+class Winner(object):
+    """A node running the job from the command line with the lease engine and heartbeats."""
+
+    def __init__(self, db, heartbeat, range, command):
+        script = os.path.splitext(runjop.__file__)[0] + '.py'
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen([sys.executable, script, '--table', 't', '--id', 'j', '--node', 'winner',
+                                             '--backend', 'sqlite', '--db', db, '--engine', 'lease',
+                                             '--heartbeat', str(heartbeat), '--range', str(range),
+                                             '--command', command],
+                                            stdout=devnull, stderr=devnull, preexec_fn=os.setsid)
+
+    def kill(self):
+        # The whole node dies, with the command it is running
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+def other_node(db, heartbeat, range):
+    return runjop.RunJOP(options('--backend', 'sqlite', '--db', db, '--node', 'other', '--engine', 'lease',
+                                 '--heartbeat', str(heartbeat), '--range', str(range)))
+
+def wait_for_claim(job, timeout, interval=0.1):
+    """Tries to claim the job until it succeeds, returns how long it took (or None after the timeout)."""
+    started = time.time()
+    while time.time() - started < timeout:
+        if job.claim(datetime.datetime.utcnow()):
+            return time.time() - started
+        time.sleep(interval)
+    return None
+
+def takeover(directory, heartbeat=1, range=1):
+    """Kills the winner while it runs the job, after its range is over, and measures when another node takes over."""
+    db = os.path.join(directory, 'takeover.db')
+    winner = Winner(db, heartbeat, range, 'sleep 60')
+    try:
+        other = other_node(db, heartbeat, range)
+        started = time.time()
+        while not (other.backend.last_execution('j') or {}).get('node') == 'winner':
+            if time.time() - started > 10:
+                raise AssertionError("the winner didn't claim the job")
+            time.sleep(0.05)
+        # Outside of the range, but the heartbeats are fresh
+        time.sleep(range + heartbeat * 2)
+        busy = not other.claim(datetime.datetime.utcnow())
+    finally:
+        winner.kill()
+    return busy, wait_for_claim(other, heartbeat * (runjop.RunJOP.heartbeat_misses + 1) + 10)
+
+class HeartbeatTest(unittest.TestCase):
+
+    heartbeat = 1
+    range = 1
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_takeover_after_winner_is_killed(self):
+        busy, elapsed = takeover(self.directory, self.heartbeat, self.range)
+        self.assertTrue(busy)
+        self.assertIsNotNone(elapsed)
+        # The lease expires after the missed heartbeats (in whole seconds)
+        self.assertLess(elapsed, self.heartbeat * (runjop.RunJOP.heartbeat_misses + 1) + 0.5)
+
+    def test_lease_released_at_the_end(self):
+        db = os.path.join(self.directory, 'runjop.db')
+        winner = Winner(db, self.heartbeat, self.range, 'sleep 3; exit 2')
+        try:
+            self.assertEqual(winner.process.wait(), 0)
+        finally:
+            winner.kill()
+        other = other_node(db, self.heartbeat, self.range)
+        self.assertTrue(other.claim(datetime.datetime.utcnow()))
+        execution = other.backend.executions('j').next()
+        self.assertEqual(execution['node'], 'other')
+        first = list(other.backend.executions('j'))[-1]
+        self.assertEqual((first['node'], first['returncode']), ('winner', 2))
+        self.assertGreaterEqual(first['duration'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
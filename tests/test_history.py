@@ -0,0 +1,113 @@
+import os
+import sys
+import shutil
+import calendar
+import datetime
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from tests.stand_ins import runjop, options, patched
+
+class HistoryTest(unittest.TestCase):
+    """Retention and history of the executions of a job, with the SQLite backend."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = os.path.join(self.directory, 'runjop.db')
+        self.backend = runjop.SQLiteBackend('t', self.db)
+        self.now = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def history(self, *args):
+        history = runjop.History(options('--backend', 'sqlite', '--db', self.db, *args))
+        if '--node' not in args:
+            history.node = None
+        return history
+
+    def insert(self, counter, hours_ago, node='a', expires_in=None):
+        when = self.now - datetime.timedelta(hours=hours_ago)
+        attrs = {'time': when.strftime('%Y-%m-%d %H:%M:%S'), 'node': node}
+        if expires_in is not None:
+            attrs['expires'] = calendar.timegm(self.now.utctimetuple()) + expires_in
+        self.assertTrue(self.backend.insert_execution('j', counter, attrs))
+
+    def counters(self, executions=None):
+        return [item['counter'] for item in (executions or self.backend.executions('j'))]
+
+    def test_keep_when_claiming(self):
+        for minutes in range(0, 12, 2):
+            job = runjop.RunJOP(options('--backend', 'sqlite', '--db', self.db, '--range', '60', '--keep', '3'))
+            self.assertTrue(job.claim(self.now + datetime.timedelta(minutes=minutes)))
+            self.assertEqual(self.counters(), range(job.counter, max(0, job.counter - 3), -1))
+        self.assertEqual(self.counters(), [6, 5, 4])
+
+    def test_keep_only_the_last_one(self):
+        for minutes in range(0, 6, 2):
+            job = runjop.RunJOP(options('--backend', 'sqlite', '--db', self.db, '--range', '60', '--keep', '1'))
+            self.assertTrue(job.claim(self.now + datetime.timedelta(minutes=minutes)))
+        self.assertEqual(self.counters(), [3])
+
+    def test_prune_keep(self):
+        for counter in range(1, 7):
+            self.insert(counter, 7 - counter)
+        self.history('--keep', '2').prune()
+        self.assertEqual(self.counters(), [6, 5])
+
+    def test_prune_max_age(self):
+        for counter, hours_ago in [(1, 72), (2, 49), (3, 47), (4, 1)]:
+            self.insert(counter, hours_ago)
+        self.history('--max-age', str(48 * 3600)).prune()
+        self.assertEqual(self.counters(), [4, 3])
+
+    def test_prune_keeps_the_last_execution(self):
+        for counter in range(1, 4):
+            self.insert(counter, 100 - counter, expires_in=-3600)
+        self.history('--keep', '1', '--max-age', '60').prune()
+        self.assertEqual(self.counters(), [3])
+
+    def test_prune_expired(self):
+        # Marked when they were inserted with a --max-age, even if 'prune' is given another one
+        for counter, expires_in in [(1, -7200), (2, -60), (3, 3600), (4, -60), (5, 3600)]:
+            self.insert(counter, 6 - counter, expires_in=expires_in)
+        self.history('--keep', '10').prune()
+        self.assertEqual(self.counters(), [5, 3])
+
+    def test_max_age_marks_executions(self):
+        job = runjop.RunJOP(options('--backend', 'sqlite', '--db', self.db, '--max-age', '3600'))
+        self.assertTrue(job.claim(self.now))
+        item = self.backend.last_execution('j')
+        self.assertEqual(item['expires'], calendar.timegm(self.now.utctimetuple()) + 3600)
+
+    def test_since_and_node(self):
+        for counter in range(1, 9):
+            self.insert(counter, 9 - counter, node='a' if counter % 2 else 'b')
+        since = (self.now - datetime.timedelta(hours=4, minutes=30)).strftime('%Y-%m-%d %H:%M:%S')
+        self.assertEqual(self.counters(self.history('--since', since).executions()), [8, 7, 6, 5])
+        self.assertEqual(self.counters(self.history('--since', since, '--node', 'a').executions()), [7, 5])
+        self.assertEqual(self.counters(self.history('--node', 'b').executions()), [8, 6, 4, 2])
+        self.assertEqual(self.counters(self.history('--since', self.now.strftime('%Y-%m-%d %H:%M:%S')).executions()), [])
+
+    def test_show(self):
+        for counter in range(1, 6):
+            self.insert(counter, 6 - counter)
+        history = self.history('--limit', '2')
+        with patched(sys, 'stdout', StringIO()):
+            history.show()
+            lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(lines[0].split('\t'), ['counter', 'time', 'node', 'finish', 'duration', 'returncode'])
+        self.assertEqual([line.split('\t')[0] for line in lines[1:]], ['5', '4'])
+
+    def test_paging(self):
+        # The lease (counter 0) is not an execution
+        self.assertTrue(self.backend.insert_execution('j', 0, {'time': '2024-01-01 10:00:00', 'node': 'a'}))
+        for counter in range(1, 11):
+            self.insert(counter, 11 - counter)
+        self.assertTrue(self.backend.insert_execution('other', 11, {'time': '2024-01-01 10:00:00', 'node': 'a'}))
+        for page_size in [1, 3, 5, 10, 100]:
+            self.assertEqual(self.counters(self.backend.executions('j', page_size=page_size)), range(10, 0, -1))
+
+if __name__ == '__main__':
+    unittest.main()
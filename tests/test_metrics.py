@@ -0,0 +1,68 @@
+import socket
+import datetime
+import threading
+import unittest
+
+import boto.exception
+
+from tests.stand_ins import runjop
+
+class CollectingSink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def send(self, record):
+        self.records.append(record)
+
+def throttled(times):
+    errors = [boto.exception.DynamoDBResponseError(400, 'Bad Request', {
+        '__type': 'com.amazonaws.dynamodb.v20111205#ProvisionedThroughputExceededException',
+        'message': 'throttled'}) for i in range(times)]
+    def call():
+        if errors:
+            raise errors.pop()
+    return call
+
+class MetricsTest(unittest.TestCase):
+
+    def test_retries_are_counted_per_invocation(self):
+        retrier = runjop.Retrier(10)
+        retrier.base = 0.001
+        sink = CollectingSink()
+        def invocation(job_id, retries):
+            metrics = runjop.Metrics(sink, id=job_id)
+            retrier.start(metrics)
+            retrier.call('put', throttled(retries))
+            metrics.emit(datetime.datetime.utcnow())
+        threads = [threading.Thread(target=invocation, args=('job-%i' % i, i)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        retries = dict((record['id'], record['retries']) for record in sink.records)
+        self.assertEqual(retries, {'job-0': {}, 'job-1': {'put': 1}, 'job-2': {'put': 2}, 'job-3': {'put': 3}})
+        self.assertEqual(retrier.retries, {'put': 6})
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            metrics = runjop.Metrics(runjop.StatsDSink('127.0.0.1', server.getsockname()[1]), id='my job')
+            metrics.phases['command'] = 1.5
+            metrics.set('outcome', 'executed')
+            for name, value in [('returncode', 0), ('bytes_spooled', 120), ('heartbeats', 3), ('leases_lost', 1)]:
+                metrics.add(name, value)
+            metrics.retry('put')
+            metrics.emit(datetime.datetime.utcnow())
+            lines = server.recv(65536).split('\n')
+        finally:
+            server.close()
+        self.assertEqual(sorted(lines), ['runjop.my_job.bytes_spooled:120|g', 'runjop.my_job.command:1500|ms',
+                                         'runjop.my_job.heartbeats:3|c', 'runjop.my_job.leases_lost:1|c',
+                                         'runjop.my_job.outcome.executed:1|c', 'runjop.my_job.retries.put:1|c',
+                                         'runjop.my_job.returncode:0|g'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+import os
+import json
+import errno
+import shutil
+import socket
+import httplib
+import tempfile
+import unittest
+import contextlib
+
+import boto.connection
+import boto.exception
+import boto.dynamodb.exceptions
+import boto.dynamodb2.exceptions
+
+from tests.stand_ins import runjop, options, patched, LocalControlPlane, LocalBucket, LocalKey
+
+def server_error():
+    return boto.exception.DynamoDBResponseError(500, 'Internal Server Error', {
+        '__type': 'com.amazonaws.dynamodb.v20111205#InternalServerError', 'message': 'internal error'})
+
+class FlakyTable(object):
+    """Stand-in for a DynamoDB table where the response of the first 'failures' writes is lost after they succeed."""
+
+    def __init__(self, failures=1):
+        self.items = {}
+        self.failures = failures
+
+    def new_item(self, hash_key, range_key, attrs=None):
+        return FlakyItem(self, (hash_key, range_key), attrs or {})
+
+    def get_item(self, hash_key, range_key=None, consistent_read=False):
+        if (hash_key, range_key) not in self.items:
+            raise boto.dynamodb.exceptions.DynamoDBKeyNotFoundError('Key does not exist.')
+        return dict(self.items[(hash_key, range_key)])
+
+    def write(self, key, attrs):
+        self.items[key] = dict(attrs)
+        if self.failures:
+            self.failures -= 1
+            raise server_error()
+
+class FlakyItem(object):
+
+    def __init__(self, table, key, attrs):
+        self.table = table
+        self.key = key
+        self.attrs = attrs
+
+    def put(self, expected_value=None):
+        if expected_value and self.key in self.table.items:
+            raise boto.dynamodb.exceptions.DynamoDBConditionalCheckFailedError(400, 'Bad Request', {
+                '__type': 'com.amazonaws.dynamodb.v20111205#ConditionalCheckFailedException',
+                'message': 'The conditional request failed'})
+        self.table.write(self.key, self.attrs)
+        return {'ConsumedCapacityUnits': 1}
+
+class FlakyDynamoDB2(object):
+    """Stand-in for the lease update of a DynamoDB2 connection, using the items of a FlakyTable."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def update_item(self, table_name, key, expression_attribute_values, **kwargs):
+        item_key = (key['job_id']['S'], int(key['counter']['N']))
+        lease = self.table.items.get(item_key, {})
+        now = int(expression_attribute_values[':now']['N'])
+        if 'lease_time' in lease and lease['lease_time'] >= int(expression_attribute_values[':cutoff']['N']):
+            raise boto.dynamodb2.exceptions.ConditionalCheckFailedException(400, 'Bad Request', {
+                '__type': 'com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException',
+                'message': 'The conditional request failed'})
+        lease = dict(lease, lease_time=now, node=expression_attribute_values[':node']['S'],
+                     executions=lease.get('executions', 0) + 1)
+        self.table.write(item_key, lease)
+        return {'Attributes': {'executions': {'N': str(lease['executions'])}}}
+
+class RetriedConditionalWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = runjop.DynamoDBBackend.__new__(runjop.DynamoDBBackend)
+        self.backend.table_name = 't'
+        self.backend.cache = None
+        self.backend.retrier = runjop.Retrier(10)
+        self.backend.table = FlakyTable()
+        self.backend.dynamodb2 = FlakyDynamoDB2(self.backend.table)
+
+    def test_insert_written_by_previous_attempt(self):
+        attrs = {'node': 'a', 'time': '2024-01-01 10:00:00'}
+        self.assertTrue(self.backend.insert_execution('j', 1, attrs))
+        self.assertEqual(self.backend.retrier.retries, {'put': 1})
+
+    def test_insert_written_by_another_node(self):
+        self.backend.table.failures = 0
+        self.assertTrue(self.backend.insert_execution('j', 1, {'node': 'b', 'time': '2024-01-01 10:00:00'}))
+        self.assertFalse(self.backend.insert_execution('j', 1, {'node': 'a', 'time': '2024-01-01 10:00:00'}))
+
+    def test_lease_taken_by_previous_attempt(self):
+        self.assertEqual(self.backend.claim_lease('j', 1000, 940, {'node': 'a'}), 1)
+        self.assertEqual(self.backend.retrier.retries, {'update_lease': 1})
+
+    def test_lease_taken_by_another_node(self):
+        self.backend.table.failures = 0
+        self.assertEqual(self.backend.claim_lease('j', 1000, 940, {'node': 'b'}), 1)
+        self.assertEqual(self.backend.claim_lease('j', 1000, 940, {'node': 'a'}), None)
+
+class StubbedResponse(object):
+
+    def __init__(self, status, data):
+        self.status = status
+        self.reason = httplib.responses[status]
+        self.body = json.dumps(data)
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+    def read(self):
+        return self.body
+
+class StubbedHTTPConnection(object):
+    """Stand-in for the HTTP connections of boto, answering each request with the next
+    response (or raising it, if it is an exception) and recording its action.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.actions = []
+
+    def request(self, method, path, body, headers):
+        self.actions.append(headers['X-Amz-Target'].split('.')[-1])
+        self.response = self.responses.pop(0)
+        if isinstance(self.response, Exception):
+            raise self.response
+
+    def getresponse(self):
+        return self.response
+
+    def close(self):
+        pass
+
+    @contextlib.contextmanager
+    def installed(self):
+        connection = self
+        with patched(boto.connection.AWSAuthConnection, 'get_http_connection', lambda *args: connection), \
+                patched(boto.connection.AWSAuthConnection, 'new_http_connection', lambda *args: connection), \
+                patched(boto.connection.AWSAuthConnection, 'put_http_connection', lambda *args: None):
+            yield self
+
+def error(status, error_type, version='20111205'):
+    return StubbedResponse(status, {'__type': 'com.amazonaws.dynamodb.v%s#%s' % (version, error_type),
+                                    'message': error_type})
+
+class BotoRetriesTest(unittest.TestCase):
+    """The calls go through boto, whose own retries must be turned off so that the Retrier sees every failure."""
+
+    attrs = {'node': 'a', 'time': '2024-01-01 10:00:00'}
+    item = {'job_id': {'S': 'j'}, 'counter': {'N': '1'}, 'node': {'S': 'a'}, 'time': {'S': '2024-01-01 10:00:00'}}
+
+    def setUp(self):
+        with LocalControlPlane().installed():
+            self.backend = runjop.DynamoDBBackend('t', 'us-east-1', runjop.Retrier(10))
+
+    def test_server_error(self):
+        # The first put is written but its response is lost
+        responses = [error(500, 'InternalServerError'), error(400, 'ConditionalCheckFailedException'),
+                     StubbedResponse(200, {'Item': self.item, 'ConsumedCapacityUnits': 1})]
+        with StubbedHTTPConnection(responses).installed() as connection:
+            self.assertTrue(self.backend.insert_execution('j', 1, self.attrs))
+        self.assertEqual(connection.actions, ['PutItem', 'PutItem', 'GetItem'])
+        self.assertEqual(self.backend.retrier.retries, {'put': 1})
+
+    def test_throttling(self):
+        responses = [error(400, 'ProvisionedThroughputExceededException'), StubbedResponse(200, {'ConsumedCapacityUnits': 1})]
+        with StubbedHTTPConnection(responses).installed() as connection:
+            self.assertTrue(self.backend.insert_execution('j', 1, self.attrs))
+        self.assertEqual(connection.actions, ['PutItem', 'PutItem'])
+        self.assertEqual(self.backend.retrier.retries, {'put': 1})
+
+    def test_network_error(self):
+        responses = [socket.error(errno.ECONNRESET, 'Connection reset by peer'),
+                     StubbedResponse(200, {'ConsumedCapacityUnits': 1})]
+        with StubbedHTTPConnection(responses).installed() as connection:
+            self.assertTrue(self.backend.insert_execution('j', 1, self.attrs))
+        self.assertEqual(connection.actions, ['PutItem', 'PutItem'])
+        self.assertEqual(self.backend.retrier.retries, {'put': 1})
+
+    def test_lease_throttling(self):
+        responses = [error(400, 'ProvisionedThroughputExceededException', '20120810'),
+                     StubbedResponse(200, {'Attributes': {'executions': {'N': '1'}}})]
+        with StubbedHTTPConnection(responses).installed() as connection:
+            self.assertEqual(self.backend.claim_lease('j', 1000, 940, {'node': 'a'}), 1)
+        self.assertEqual(connection.actions, ['UpdateItem', 'UpdateItem'])
+        self.assertEqual(self.backend.retrier.retries, {'update_lease': 1})
+
+def slow_down():
+    return boto.exception.S3ResponseError(503, 'Slow Down')
+
+class LongCommandTest(unittest.TestCase):
+    """The calls made after a command running for longer than the deadline are still retried."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(os.path.join(self.directory, 's3'))
+        self.bucket.errors = [slow_down()]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_job(self, command, *args):
+        job = runjop.RunJOP(options('--backend', 'sqlite', '--db', os.path.join(self.directory, 'runjop.db'),
+                                    '--s3log', 's3://bucket/logs', '--retry-deadline', '1', '--command', command,
+                                    *args), s3_buckets={'bucket': self.bucket})
+        with patched(runjop, 'Key', LocalKey):
+            job.run()
+        self.assertEqual(len(self.bucket.keys()), 1)
+        return job.metrics.retries, os.path.getsize(self.bucket.path(self.bucket.keys()[0]))
+
+    def test_upload(self):
+        retries, size = self.run_job('sleep 2; echo done')
+        self.assertEqual(retries, {'set_contents': 1})
+
+    def test_part_streamed_while_running(self):
+        retries, size = self.run_job('sleep 2; head -c %i /dev/zero' % runjop.S3StreamWriter.part_size, '--stream')
+        self.assertEqual(retries, {'initiate_multipart': 1})
+        self.assertGreater(size, runjop.S3StreamWriter.part_size)
+
+class RetrierTest(unittest.TestCase):
+
+    def test_throttling_is_retried(self):
+        retrier = runjop.Retrier(10)
+        errors = [server_error(), server_error()]
+        def call():
+            if errors:
+                raise errors.pop()
+            return 'done'
+        self.assertEqual(retrier.call('call', call), 'done')
+        self.assertEqual(retrier.retries, {'call': 2})
+
+    def test_other_errors_are_raised(self):
+        retrier = runjop.Retrier(10)
+        def call():
+            raise boto.exception.DynamoDBResponseError(400, 'Bad Request', {
+                '__type': 'com.amazonaws.dynamodb.v20111205#ValidationException', 'message': 'invalid'})
+        self.assertRaises(boto.exception.DynamoDBResponseError, retrier.call, 'call', call)
+        self.assertEqual(retrier.retries, {})
+
+    def test_deadline(self):
+        retrier = runjop.Retrier(0.01)
+        retrier.base = 1
+        def call():
+            raise server_error()
+        self.assertRaises(boto.exception.DynamoDBResponseError, retrier.call, 'call', call)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import datetime
+import unittest
+
+from tests.stand_ins import runjop
+
+class CronScheduleTest(unittest.TestCase):
+
+    fields = [
+        # (expression, minutes, hours, days, months, weekdays)
+        ('* * * * *', range(60), range(24), range(1, 32), range(1, 13), range(8)),
+        ('*/15 * * * *', [0, 15, 30, 45], range(24), range(1, 32), range(1, 13), range(8)),
+        ('5/20 */6 * * *', [5, 25, 45], [0, 6, 12, 18], range(1, 32), range(1, 13), range(8)),
+        ('10-30/10 1-5 * * *', [10, 20, 30], [1, 2, 3, 4, 5], range(1, 32), range(1, 13), range(8)),
+        ('0,30 8,12-14 1,15 1-3,12 1-5', [0, 30], [8, 12, 13, 14], [1, 15], [1, 2, 3, 12], [1, 2, 3, 4, 5]),
+        ('59 23 31 12 6', [59], [23], [31], [12], [6]),
+        # Both 0 and 7 are Sunday
+        ('0 0 * * 0', [0], [0], range(1, 32), range(1, 13), [0]),
+        ('0 0 * * 7', [0], [0], range(1, 32), range(1, 13), [0, 7]),
+        ('0 0 * * 5-7', [0], [0], range(1, 32), range(1, 13), [0, 5, 6, 7]),
+    ]
+
+    def test_fields(self):
+        for expression, minutes, hours, days, months, weekdays in self.fields:
+            schedule = runjop.CronSchedule(expression)
+            self.assertEqual((schedule.minutes, schedule.hours, schedule.days, schedule.months, schedule.weekdays),
+                             (set(minutes), set(hours), set(days), set(months), set(weekdays)), expression)
+
+    matches = [
+        # (expression, when, matches) with 2024-01-01 a Monday
+        ('*/15 * * * *', datetime.datetime(2024, 1, 1, 10, 45), True),
+        ('*/15 * * * *', datetime.datetime(2024, 1, 1, 10, 46), False),
+        ('0 9-17 * * 1-5', datetime.datetime(2024, 1, 5, 17, 0), True),
+        ('0 9-17 * * 1-5', datetime.datetime(2024, 1, 6, 12, 0), False),
+        ('0 9-17 * * 1-5', datetime.datetime(2024, 1, 5, 18, 0), False),
+        ('0 0 * * 0', datetime.datetime(2024, 1, 7), True),
+        ('0 0 * * 7', datetime.datetime(2024, 1, 7), True),
+        ('0 0 * * 7', datetime.datetime(2024, 1, 8), False),
+        ('0 0 1 */3 *', datetime.datetime(2024, 4, 1), True),
+        ('0 0 1 */3 *', datetime.datetime(2024, 2, 1), False),
+        # Only the day of the month is restricted
+        ('0 0 13 * *', datetime.datetime(2024, 1, 13), True),
+        ('0 0 13 * *', datetime.datetime(2024, 1, 5), False),
+        # Only the day of the week is restricted
+        ('0 0 * * 5', datetime.datetime(2024, 1, 5), True),
+        ('0 0 * * 5', datetime.datetime(2024, 1, 13), False),
+        # Both are restricted: either one matches
+        ('0 0 13 * 5', datetime.datetime(2024, 1, 13), True),
+        ('0 0 13 * 5', datetime.datetime(2024, 1, 5), True),
+        ('0 0 13 * 5', datetime.datetime(2024, 1, 6), False),
+        ('0 0 13 2 5', datetime.datetime(2024, 1, 13), False),
+    ]
+
+    def test_matches(self):
+        for expression, when, matches in self.matches:
+            self.assertEqual(runjop.CronSchedule(expression).matches(when), matches, "%s at %s" % (expression, when))
+
+    invalid = [
+        '',
+        '* * * *',
+        '* * * * * *',
+        '60 * * * *',
+        '* 24 * * *',
+        '* * 0 * *',
+        '* * 32 * *',
+        '* * * 0 *',
+        '* * * 13 *',
+        '* * * * 8',
+        '30-10 * * * *',
+        '*/0 * * * *',
+        '*/x * * * *',
+        'a * * * *',
+        '1,,2 * * * *',
+        '-1 * * * *',
+    ]
+
+    def test_invalid(self):
+        for expression in self.invalid:
+            self.assertRaises(ValueError, runjop.CronSchedule, expression)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import re
+import shutil
+import resource
+import tempfile
+import unittest
+import multiprocessing
+
+from tests.stand_ins import runjop, options, patched, LocalBucket, LocalKey
+
+class S3StreamWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory)
+        self.retrier = runjop.Retrier(10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_single_put(self):
+        with patched(runjop, 'Key', LocalKey):
+            writer = runjop.S3StreamWriter(self.bucket, 'logs/job.partial', self.retrier)
+            writer.write('hello ')
+            writer.write('world')
+            writer.close('logs/job.log')
+        self.assertEqual(self.bucket.keys(), ['logs/job.log'])
+        self.assertEqual(self.bucket.read('logs/job.log'), 'hello world')
+        self.assertEqual(self.bucket.requests, 1)
+        self.assertEqual(writer.size, 11)
+
+    def test_multipart_and_rename(self):
+        writer = runjop.S3StreamWriter(self.bucket, 'logs/job.partial', self.retrier)
+        writer.part_size = 4
+        for data in ['0123', '45', '6789', 'a']:
+            writer.write(data)
+        writer.close('logs/job.log')
+        self.assertEqual(self.bucket.keys(), ['logs/job.log'])
+        self.assertEqual(self.bucket.read('logs/job.log'), '0123456789a')
+        self.assertEqual(self.bucket.headers['logs/job.log'], {'Content-Type': 'text/plain'})
+
+    def test_abort(self):
+        writer = runjop.S3StreamWriter(self.bucket, 'logs/job.partial', self.retrier)
+        writer.part_size = 4
+        writer.write('0123456789')
+        writer.abort()
+        self.assertEqual(self.bucket.keys(), [])
+
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_streaming(directory, command, pipe):
+    # In a new process, so that its peak memory is not the one of the tests
+    bucket = LocalBucket(os.path.join(directory, 's3'))
+    job = runjop.RunJOP(options('--backend', 'sqlite', '--db', os.path.join(directory, 'runjop.db'),
+                                '--stream', '--s3log', 's3://bucket/logs', '--command', command),
+                        s3_buckets={'bucket': bucket})
+    before = max_rss()
+    job.run()
+    pipe.send((before, max_rss()))
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_job(self, command):
+        parent, child = multiprocessing.Pipe()
+        with patched(runjop, 'Key', LocalKey):
+            process = multiprocessing.Process(target=run_streaming, args=(self.directory, command, child))
+            process.start()
+            before, after = parent.recv()
+            process.join()
+        self.assertEqual(process.exitcode, 0)
+        bucket = LocalBucket(os.path.join(self.directory, 's3'))
+        keys = bucket.keys()
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(re.match(r'^logs/t-j-\d{8}-\d{6}-n-0\.log$', keys[0]), keys[0])
+        return bucket, keys[0], after - before
+
+    def test_small_output(self):
+        bucket, key_name, _ = self.run_job('echo Hello World')
+        self.assertEqual(bucket.read(key_name), 'command:\necho Hello World\noutput:\nHello World\n')
+
+    def test_large_output_memory(self):
+        size = 200 * 1024 * 1024
+        command = 'head -c %i /dev/zero' % size
+        bucket, key_name, growth = self.run_job(command)
+        header = 'command:\n%s\noutput:\n' % command
+        self.assertEqual(os.path.getsize(bucket.path(key_name)), len(header) + size)
+        # At most a part of the output is in memory, not all of it
+        self.assertLess(growth, 4 * runjop.S3StreamWriter.part_size)
+
+if __name__ == '__main__':
+    unittest.main()
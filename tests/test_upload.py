@@ -0,0 +1,86 @@
+import os
+import imp
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from tests.stand_ins import runjop, patched, LocalBucket, LocalKey
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = os.path.join(self.directory, 'spool')
+        self.bucket = LocalBucket(os.path.join(self.directory, 's3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spooled_logs_are_uploaded_compressed(self):
+        data = 'line of repetitive log output\n' * 100000
+        headers = {'Content-Type': 'text/plain', 'Content-Encoding': 'gzip'}
+        for i in range(3):
+            writer = runjop.CompressedWriter(runjop.SpoolWriter(self.spool, 'bucket', headers), 'gzip')
+            writer.write(data)
+            writer.close('logs/job-%i.log' % i)
+            self.assertLess(writer.size, len(data) / 10)
+        uploader = runjop.SpoolUploader(self.spool, runjop.Retrier(10))
+        uploader.get_bucket = lambda bucket_name: self.bucket
+        with patched(runjop, 'Key', LocalKey):
+            uploader.run()
+        self.assertEqual(self.bucket.keys(), ['logs/job-0.log', 'logs/job-1.log', 'logs/job-2.log'])
+        self.assertEqual(zlib.decompress(self.bucket.read('logs/job-0.log'), 16 + zlib.MAX_WBITS), data)
+        self.assertEqual(self.bucket.headers['logs/job-0.log'], headers)
+        self.assertEqual(os.listdir(self.spool), ['.lock'])
+
+    def start_uploader(self, module=runjop):
+        if not os.path.isdir(self.spool):
+            os.makedirs(self.spool)
+        job = module.RunJOP.__new__(module.RunJOP)
+        job.spool = self.spool
+        job.retrier = module.Retrier(10)
+        job.logfile = None
+        # Not from the directory of the project, where the package could be imported anyway
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            process = job.start_uploader()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(process.wait(), 0)
+
+    def read_log(self, name='uploader.log'):
+        with open(os.path.join(self.spool, name)) as f:
+            return f.read()
+
+    def test_uploader_of_the_package(self):
+        self.start_uploader(runjop)
+        self.assertEqual(self.read_log(), '')
+
+    def test_uploader_of_the_script(self):
+        script = os.path.join(self.directory, 'runjop.py')
+        shutil.copy(os.path.splitext(runjop.__file__)[0] + '.py', script)
+        self.start_uploader(imp.load_source('runjop_script', script))
+        self.assertEqual(self.read_log(), '')
+
+    def test_log_of_running_uploader_is_kept(self):
+        os.makedirs(self.spool)
+        # The stderr of an uploader still working on the spool
+        with open(os.path.join(self.spool, 'uploader.log'), 'a', 0) as running:
+            running.write('uploading\n')
+            self.start_uploader()
+            running.write('uploaded\n')
+        self.assertEqual(self.read_log(), 'uploading\nuploaded\n')
+
+    def test_log_is_rotated(self):
+        os.makedirs(self.spool)
+        with open(os.path.join(self.spool, 'uploader.log'), 'w') as f:
+            f.write('x' * 100)
+        with patched(runjop.RunJOP, 'uploader_log_size', 10):
+            self.start_uploader()
+        self.assertEqual(self.read_log('uploader.log.1'), 'x' * 100)
+        self.assertEqual(self.read_log(), '')
+
+if __name__ == '__main__':
+    unittest.main()